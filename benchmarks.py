@@ -0,0 +1,405 @@
+"""Offline micro-benchmarks for the scraper hot paths.
+
+Run `python benchmarks.py` (needs pandas + numpy, no network, no secrets).
+Every benchmark checks the new path against the old one before timing it.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import inspect
+import glob
+import gzip
+import tempfile
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import scraper
+from history_store import HistoryStore
+from quotes import Quote, write_quotes, symbol_table, quote_columns
+import history_codec
+import migrate_legacy
+from publish import ShardRing
+import sparklines
+from sparklines import market_sparklines
+
+# --- SYNTHETIC DATA ---
+
+def synthetic_batch(n_symbols=100, days=5, tz="America/New_York", seed=7):
+    """yf.download(group_by='ticker')-shaped frame with gaps and dead tickers."""
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range(end="2026-08-07", periods=days)
+    days = [pd.date_range(f"{d.date()} 09:30", f"{d.date()} 15:55", freq="5min", tz=tz) for d in sessions]
+    index = days[0].append(days[1:])
+
+    symbols = [f"S{i:04d}" for i in range(n_symbols)]
+    frames = {}
+    for i, symbol in enumerate(symbols):
+        close = 100 + rng.standard_normal(len(index)).cumsum()
+        close[rng.random(len(index)) < 0.03] = np.nan  # Missing candles
+        if i % 37 == 0: close[:] = np.nan              # Delisted ticker
+        frames[symbol] = pd.DataFrame({
+            "Open": close + 0.1, "High": close + 0.2, "Low": close - 0.2,
+            "Close": close, "Adj Close": close, "Volume": 1000.0,
+        }, index=index)
+    return symbols, pd.concat(frames, axis=1)
+
+def fake_context(symbols):
+    ctx = SimpleNamespace(
+        metadata_map={s: {"symbol": s, "company_name": s, "market": "US"} for s in symbols},
+        watermarks={},
+        latest_prices_cache=[],
+        history_cache={},  # Only used by the legacy reference
+        history=HistoryStore(scraper.RESAMPLE_SECONDS),
+        quarantine=SimpleNamespace(clear=lambda symbol: None),
+    )
+    ctx.session_of = lambda symbol: scraper.session_window(symbol, ctx.metadata_map[symbol]["market"])
+    return ctx
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+# --- REFERENCE (pre-vectorization) TRANSFORM ---
+
+def legacy_process_batch(batch, data, ctx):
+    """The original per-symbol loop, kept as the reference for bench_transform."""
+    payload = []
+    for symbol in batch:
+        try:
+            if len(batch) == 1: stock_df = data
+            else:
+                if symbol not in data.columns.levels[0]: continue
+                stock_df = data[symbol]
+
+            if stock_df.empty: continue
+            stock_df = stock_df.dropna(subset=['Close'])
+            if stock_df.empty: continue
+
+            meta = ctx.metadata_map.get(symbol, {})
+            market_type = scraper.resolve_market(symbol, meta.get('market', 'US'))
+
+            last_candle = stock_df.iloc[-1]
+            current_price = float(last_candle['Close'])
+            current_time = last_candle.name
+
+            prev_data = stock_df[stock_df.index.normalize() < current_time.normalize()]
+            prev_close = float(prev_data.iloc[-1]['Close']) if not prev_data.empty else float(stock_df.iloc[0]['Open'])
+
+            change_value = current_price - prev_close
+            change_pct = ((change_value) / prev_close * 100) if prev_close != 0 else 0.0
+
+            data_point = {
+                "symbol": symbol,
+                "company_name": meta.get('company_name', symbol),
+                "market": market_type,
+                "price": round(current_price, 2),
+                "change_percent": round(change_pct, 2),
+                "change_value": round(change_value, 2),
+                "recorded_at": current_time.to_pydatetime().isoformat(),
+                "previous_close": round(prev_close, 2)
+            }
+            payload.append(data_point)
+            ctx.latest_prices_cache.append(data_point)
+
+            last_ts = stock_df.index[-1]
+            todays_data = stock_df[stock_df.index.normalize() == last_ts.normalize()].copy()
+            todays_data = todays_data.resample(scraper.RESAMPLE_INTERVAL).asfreq()
+            if not todays_data.empty:
+                ctx.history_cache[symbol] = {
+                    "s": int(todays_data.index[0].timestamp()),
+                    "p": [round(x, 2) if pd.notna(x) else None for x in todays_data['Close'].tolist()]
+                }
+        except Exception:
+            continue
+    return payload
+
+# --- BENCHMARKS ---
+
+def bench_transform(n_symbols=100):
+    """Per-symbol pandas loop vs. the vectorized whole-batch transform."""
+    batch, data = synthetic_batch(n_symbols)
+
+    old_ctx, new_ctx = fake_context(batch), fake_context(batch)
+    old = legacy_process_batch(batch, data, old_ctx)
+    new = scraper.process_batch(batch, data, new_ctx)
+    assert old == [q._asdict() for q in new], "quotes differ from the per-symbol reference"
+    assert old_ctx.history_cache == dict(new_ctx.history.items()), "history differs from the per-symbol reference"
+
+    t_old = timed(lambda: legacy_process_batch(batch, data, fake_context(batch)))
+    t_new = timed(lambda: scraper.process_batch(batch, data, fake_context(batch)))
+    print(f"📊 transform {n_symbols} symbols: per-symbol {t_old * 1000:.1f}ms | "
+          f"vectorized {t_new * 1000:.1f}ms | {t_old / t_new:.1f}x faster (identical output)")
+
+def bench_grouping(per_market=25):
+    """Mixed-exchange batch (union index) vs. one dense batch per exchange."""
+    markets = [("US", "America/New_York"), ("INDIA", "Asia/Kolkata"),
+               ("UK", "Europe/London"), ("GERMANY", "Europe/Berlin")]
+    groups = []
+    for i, (market, tz) in enumerate(markets):
+        symbols, data = synthetic_batch(per_market, tz=tz, seed=i)
+        symbols = [f"{market}{s}" for s in symbols]
+        data.columns = data.columns.set_levels([f"{market}{s}" for s in data.columns.levels[0]], level=0)
+        groups.append((market, symbols, data))
+
+    # What yf.download returns for the mixed batch: everything on the UTC union index
+    mixed_symbols = [s for _, symbols, _ in groups for s in symbols]
+    mixed = pd.concat([d.tz_convert("UTC") for _, _, d in groups], axis=1, sort=True)
+
+    def context():
+        ctx = fake_context(mixed_symbols)
+        for market, symbols, _ in groups:
+            for s in symbols: ctx.metadata_map[s]["market"] = market
+        return ctx
+
+    # Same quotes either way (only recorded_at's UTC offset differs)
+    strip = lambda rows: sorted(q._replace(recorded_at=None) for q in rows)
+    mixed_out = scraper.process_batch(mixed_symbols, mixed, context())
+    dense_out = [r for _, s, d in groups for r in scraper.process_batch(s, d, context())]
+    assert strip(mixed_out) == strip(dense_out), "grouped batches changed the quotes"
+
+    mixed_bytes = mixed.memory_usage(index=True).sum()
+    dense_bytes = max(d.memory_usage(index=True).sum() for _, _, d in groups)
+    t_mixed = timed(lambda: scraper.process_batch(mixed_symbols, mixed, context()))
+    t_dense = timed(lambda: [scraper.process_batch(s, d, context()) for _, s, d in groups])
+    print(f"📊 grouping {len(mixed_symbols)} symbols: mixed frame {len(mixed)} rows / "
+          f"{mixed_bytes / 1e6:.2f} MB, {t_mixed * 1000:.1f}ms | per-exchange peak "
+          f"{max(len(d) for _, _, d in groups)} rows / {dense_bytes / 1e6:.2f} MB, {t_dense * 1000:.1f}ms")
+
+def quote_rows(n_symbols):
+    rng = random.Random(11)
+    prices = [round(100 + rng.gauss(0, 20), 2) for _ in range(n_symbols)]
+    return [(f"S{i:05d}", f"Company \u00e9 {i}", "US", p, 1.25, -0.5,
+             "2026-08-07T15:55:00-04:00", p + 0.5) for i, p in enumerate(prices)]
+
+def dict_pipeline(rows):
+    """Old shape: one dict per quote, a second one for Supabase, json.dump."""
+    cache = [dict(zip(Quote._fields, r)) for r in rows]
+    db = [{k: p[k] for k in ("symbol", "price", "change_percent", "change_value", "recorded_at")} for p in cache]
+    f = io.StringIO()
+    json.dump(cache, f)
+    return cache, db, f.getvalue()
+
+def quote_pipeline(rows):
+    cache = [Quote(*r) for r in rows]
+    db = [q.db_row() for q in cache]
+    f = io.StringIO()
+    write_quotes(cache, f)
+    return cache, db, f.getvalue()
+
+def traced(func, rows):
+    """(allocated blocks still alive, peak bytes) of one call."""
+    tracemalloc.start()
+    kept = func(rows)
+    blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del kept
+    return blocks, peak
+
+def peak_rss(pipeline, n_symbols):
+    """Peak RSS (KB) of a bare interpreter (no pandas arenas) running one pipeline.
+
+    VmHWM rather than ru_maxrss: the latter is inherited from this (large)
+    parent process across fork/exec on Linux.
+    """
+    source = "\n".join(inspect.getsource(f) for f in (quote_rows, dict_pipeline, quote_pipeline))
+    code = (f"import io, json, random\nfrom quotes import Quote, write_quotes\n{source}\n"
+            f"{pipeline}(quote_rows({n_symbols}))\n"
+            f"print(next(l.split()[1] for l in open('/proc/self/status') if l.startswith('VmHWM')))")
+    return int(subprocess.check_output([sys.executable, "-c", code], text=True))
+
+def bench_quotes(n_symbols=5000):
+    """Dict per quote (+ DB copy + json.dump) vs. Quote tuples + template writer."""
+    rows = quote_rows(n_symbols)
+    old, new = dict_pipeline(rows), quote_pipeline(rows)
+    assert old[1] == new[1], "Supabase rows differ"
+    assert old[2] == new[2], "latest_prices.json is not byte-identical"
+
+    (b_old, p_old), (b_new, p_new) = traced(dict_pipeline, rows), traced(quote_pipeline, rows)
+    t_old, t_new = timed(lambda: dict_pipeline(rows)), timed(lambda: quote_pipeline(rows))
+    rss_old, rss_new = peak_rss("dict_pipeline", n_symbols), peak_rss("quote_pipeline", n_symbols)
+    print(f"📊 quotes {n_symbols} symbols: dicts {b_old} blocks / peak {p_old / 1e6:.2f} MB / "
+          f"RSS {rss_old / 1024:.1f} MB / {t_old * 1000:.1f}ms | tuples {b_new} blocks / peak {p_new / 1e6:.2f} MB / "
+          f"RSS {rss_new / 1024:.1f} MB / {t_new * 1000:.1f}ms (identical JSON)")
+
+def bench_codec(pattern="history_*.json"):
+    """JSON shards vs. the binary encoding: round trip, size and decode time per shard."""
+    total_json = total_bin = 0
+    for path in sorted(glob.glob(pattern)):
+        if path == scraper.DELTA_FILE: continue
+        with open(path, 'rb') as f:
+            raw = f.read()
+        shard = json.loads(raw)
+        blob = history_codec.encode(shard)
+        assert history_codec.decode(blob) == shard, f"{path} does not round-trip"
+
+        t_json = timed(lambda: json.loads(raw))
+        t_bin = timed(lambda: history_codec.decode(blob))
+        total_json, total_bin = total_json + len(raw), total_bin + len(blob)
+        print(f"📊 codec {path}: {len(raw) / 1024:.1f} KB -> {len(blob) / 1024:.1f} KB "
+              f"({len(blob) / len(raw):.0%}) | decode json {t_json * 1000:.2f}ms, bin {t_bin * 1000:.2f}ms")
+    if total_json:
+        print(f"📊 codec total: {total_json / 1024:.0f} KB -> {total_bin / 1024:.0f} KB ({total_bin / total_json:.0%})")
+
+def bench_sharding(count=16):
+    """First-letter shards vs. the consistent-hash ring: size spread and churn."""
+    history = scraper.load_history_shards()
+    if not history: return print("📊 sharding: no history shards to measure")
+    size = lambda data: len(json.dumps(data, separators=(',', ':')))
+
+    letters = {}
+    for symbol, data in history.items():
+        name = symbol[0].upper() if symbol[0].isalpha() else "0-9"
+        letters.setdefault(name, {})[symbol] = data
+    ring = ShardRing(count)
+    hashed = ring.split(sorted(history.items()))
+
+    for label, shards in (("first letter", letters), (f"ring x{count}", hashed)):
+        sizes = sorted(size(d) for d in shards.values())
+        print(f"📊 sharding {label}: {len(sizes)} files | min {sizes[0] / 1024:.1f} KB | "
+              f"max {sizes[-1] / 1024:.1f} KB | max/avg {sizes[-1] * len(sizes) / sum(sizes):.2f}")
+
+    bigger = ShardRing(count + 1)
+    moved = sum(ring.shard_of(s) != bigger.shard_of(s) for s in history)
+    print(f"📊 sharding {count} -> {count + 1} shards moves {moved / len(history):.1%} of symbols "
+          f"(ideal {1 / (count + 1):.1%}); new symbols move none")
+
+def bench_columnar(path="latest_prices.json"):
+    """Row objects vs. columnar quotes + static symbol table: bytes and parse time."""
+    quotes = [Quote.from_dict(r) for r in scraper.load_json(path, [])]
+    if not quotes: return print(f"📊 columnar: no {path} to measure")
+    metadata = {q.symbol: {"symbol": q.symbol, "company_name": q.company_name, "market": q.market} for q in quotes}
+
+    rows = json.dumps([q._asdict() for q in quotes]).encode()
+    table = json.dumps(symbol_table(metadata), separators=(',', ':')).encode()
+    columns = json.dumps(quote_columns(quotes, sorted(metadata), "v"), separators=(',', ':')).encode()
+
+    # Client side: parse, then look up one symbol's price
+    symbol = quotes[len(quotes) // 2].symbol
+    def parse_rows():
+        return {r["symbol"]: r for r in json.loads(rows)}[symbol]["price"]
+    static = json.loads(table)["symbol"]
+    index = {s: i for i, s in enumerate(static)}
+    def parse_columns():
+        return json.loads(columns)["price"][index[symbol]]
+    assert parse_rows() == parse_columns(), "columnar price differs"
+
+    gz = lambda b: len(gzip.compress(b, 9))
+    t_rows, t_cols = timed(parse_rows), timed(parse_columns)
+    print(f"📊 columnar {len(quotes)} quotes: rows {len(rows) / 1024:.0f} KB ({gz(rows) / 1024:.0f} KB gz), "
+          f"{t_rows * 1000:.2f}ms parse | columns {len(columns) / 1024:.0f} KB ({gz(columns) / 1024:.0f} KB gz), "
+          f"{t_cols * 1000:.2f}ms parse | static table {len(table) / 1024:.0f} KB, fetched once")
+
+def lttb_reference(points, n_out):
+    """Textbook scalar LTTB over [(x, y)], the reference for bench_sparklines."""
+    if len(points) <= n_out: return points
+    every = (len(points) - 2) / (n_out - 2)
+    out, a = [points[0]], 0
+    for i in range(n_out - 2):
+        lo, hi = int(every * (i + 1)) + 1, min(int(every * (i + 2)) + 1, len(points))
+        avg_x = sum(p[0] for p in points[lo:hi]) / (hi - lo)
+        avg_y = sum(p[1] for p in points[lo:hi]) / (hi - lo)
+        ax, ay = points[a]
+        best, best_area = None, -1.0
+        for j in range(int(every * i) + 1, int(every * (i + 1)) + 1):
+            px, py = points[j]
+            area = round(abs((ax - avg_x) * (py - ay) - (ax - px) * (avg_y - ay)), 9)
+            if area > best_area: best, best_area = j, area
+        out.append(points[best])
+        a = best
+    out.append(points[-1])
+    return out
+
+def bench_sparklines(n_out=30):
+    """Vectorized LTTB vs. the scalar reference, and sparkline vs. full shard bytes."""
+    history = scraper.load_history_shards()
+    if not history: return print("📊 sparklines: no history shards to measure")
+    store = HistoryStore(scraper.RESAMPLE_SECONDS)
+    for symbol, series in history.items():
+        day = series["s"] - series["s"] % 86400
+        store.put(symbol, "US", day, (0, 86400), series)
+
+    lines = market_sparklines(store, n_out)["US"]
+    same, errors = 0, []
+    for symbol, series in history.items():
+        points = [(series["s"] + i * store.step, p) for i, p in enumerate(series["p"]) if p is not None]
+        got = sparklines.decode(lines[symbol], store.step)
+        # Reference in slot units, like the store's grids
+        slots = [((t - series["s"]) // store.step, p) for t, p in points]
+        same += [t for t, _ in got] == [series["s"] + i * store.step for i, _ in lttb_reference(slots, n_out)]
+        # Shape check: mean gap between the day's prices and the drawn line, in % of the range
+        xs, ys = zip(*got)
+        span = (max(p for _, p in points) - min(p for _, p in points)) or 1
+        errors.append(np.mean([abs(np.interp(t, xs, ys) - p) for t, p in points]) / span)
+
+    full = json.dumps(history, separators=(',', ':')).encode()
+    small = json.dumps(lines, separators=(',', ':')).encode()
+    gz = lambda b: len(gzip.compress(b, 9))
+    t = timed(lambda: market_sparklines(store, n_out))
+    print(f"📊 sparklines {len(history)} symbols: {same} pick the same points as scalar LTTB | "
+          f"{len(full) / 1024:.0f} KB shards -> {len(small) / 1024:.0f} KB ({len(full) / len(small):.1f}x smaller, "
+          f"{gz(full) / gz(small):.1f}x gzipped) | {t * 1000:.1f}ms | "
+          f"mean deviation {np.median(errors):.1%} (p95 {np.percentile(errors, 95):.1%}) of the day's range")
+
+def bench_migrate(paths=("history.json", "data/latest_prices.json")):
+    """Streaming legacy migration vs. json.load of the same files: peak memory."""
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths: return print("📊 migrate: no legacy files to convert")
+    size = sum(os.path.getsize(p) for p in paths)
+
+    def load_all():
+        data = []
+        for path in paths:
+            with open(path) as f: data.append(json.load(f))
+        return data
+
+    with tempfile.TemporaryDirectory() as out:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        stats = migrate_legacy.migrate(paths, out, ("json", "binary", "columnar"))
+        t_stream = time.perf_counter() - t0
+        stream_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Columnar output must match what the scraper publishes for the same quotes
+        with open(os.path.join(out, "latest_prices.json")) as f:
+            quotes = [Quote.from_dict(row) for row in json.load(f)]
+        with open(os.path.join(out, "symbols.json"), 'rb') as f:
+            table_bytes = f.read()
+        with open(os.path.join(out, "latest_columns.json")) as f:
+            columns = json.load(f)
+        table = symbol_table({q.symbol: q._asdict() for q in quotes})
+        same_table = json.loads(table_bytes) == table
+        same_columns = columns == quote_columns(quotes, table["symbol"], columns["v"])
+
+    tracemalloc.start()
+    load_all()
+    load_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"📊 migrate {size / 1e6:.1f} MB legacy -> {stats['series']} series, {stats['quotes']} quotes "
+          f"in {t_stream:.2f}s | peak {stream_peak / 1e6:.1f} MB streaming vs {load_peak / 1e6:.1f} MB json.load | "
+          f"columnar matches scraper layout: {same_table and same_columns}")
+
+BENCHMARKS = {
+    "transform": bench_transform,
+    "grouping": bench_grouping,
+    "quotes": bench_quotes,
+    "codec": bench_codec,
+    "sharding": bench_sharding,
+    "columnar": bench_columnar,
+    "sparklines": bench_sparklines,
+    "migrate": bench_migrate,
+}
+
+if __name__ == "__main__":
+    for name in (sys.argv[1:] or BENCHMARKS):
+        BENCHMARKS[name]()
@@ -0,0 +1,155 @@
+"""Compact binary encoding of the history shards (history_X.bin).
+
+Same content as history_X.json ({symbol: {"s": start, "p": [price | null]}}),
+laid out as:
+
+    b"HST1"  varint(symbol count)
+    per symbol:
+        varint(len) name(utf-8)
+        zigzag(s - previous symbol's s)
+        decimals (1 byte; 255 = raw float64 values)
+        varint(slots)
+        varint(run count) varint(run)...   gap bitmap, alternating runs of
+                                            filled / empty slots, filled first
+        zigzag(tick delta)...               one per filled slot, ticks are
+                                            price * 10**decimals, first delta
+                                            is from 0
+
+Varints are unsigned LEB128, zigzag maps signed ints onto them
+(0, -1, 1, -2 ... -> 0, 1, 2, 3 ...). decode() is the reference decoder.
+"""
+import struct
+
+MAGIC = b"HST1"
+
+# Most decimals tried before a series falls back to raw float64
+MAX_DECIMALS = 6
+RAW = 255
+
+# --- PRIMITIVES ---
+
+def put_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def put_zigzag(out, n):
+    put_varint(out, n << 1 if n >= 0 else (-n << 1) - 1)
+
+def get_varint(buf, pos):
+    n = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80: return n, pos
+        shift += 7
+
+def get_zigzag(buf, pos):
+    n, pos = get_varint(buf, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+# --- ENCODER ---
+
+def series_decimals(prices):
+    """Fewest decimals that reproduce every price exactly, or RAW."""
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10 ** decimals
+        if all(round(p * scale) / scale == p for p in prices): return decimals
+    return RAW
+
+def gap_runs(prices):
+    """Alternating filled / empty run lengths, starting with a (maybe 0) filled run."""
+    runs, filled, length = [], True, 0
+    for p in prices:
+        if (p is not None) == filled:
+            length += 1
+        else:
+            runs.append(length)
+            filled, length = not filled, 1
+    runs.append(length)
+    return runs
+
+def header(count):
+    out = bytearray(MAGIC)
+    put_varint(out, count)
+    return bytes(out)
+
+def encode_series(symbol, series, last_start):
+    """One symbol's record; `last_start` = "s" of the record before it (0 for the first)."""
+    out = bytearray()
+    name = symbol.encode()
+    put_varint(out, len(name))
+    out += name
+    put_zigzag(out, series["s"] - last_start)
+
+    prices = series["p"]
+    filled = [p for p in prices if p is not None]
+    decimals = series_decimals(filled)
+    out.append(decimals)
+    put_varint(out, len(prices))
+
+    runs = gap_runs(prices)
+    put_varint(out, len(runs))
+    for run in runs: put_varint(out, run)
+
+    if decimals == RAW:
+        out += struct.pack(f"<{len(filled)}d", *filled)
+        return bytes(out)
+    scale, tick = 10 ** decimals, 0
+    for p in filled:
+        t = round(p * scale)
+        put_zigzag(out, t - tick)
+        tick = t
+    return bytes(out)
+
+def encode(shard):
+    """{symbol: {s, p}} -> bytes."""
+    out = bytearray(header(len(shard)))
+    last_start = 0
+    for symbol, series in shard.items():
+        out += encode_series(symbol, series, last_start)
+        last_start = series["s"]
+    return bytes(out)
+
+# --- REFERENCE DECODER ---
+
+def decode(buf):
+    """bytes -> {symbol: {s, p}}, equal to the JSON shard it was encoded from."""
+    if buf[:4] != MAGIC: raise ValueError("not a history shard")
+    count, pos = get_varint(buf, 4)
+    shard, start = {}, 0
+    for _ in range(count):
+        size, pos = get_varint(buf, pos)
+        symbol = buf[pos:pos + size].decode()
+        pos += size
+        delta, pos = get_zigzag(buf, pos)
+        start += delta
+        decimals = buf[pos]
+        slots, pos = get_varint(buf, pos + 1)
+
+        n_runs, pos = get_varint(buf, pos)
+        runs = []
+        for _ in range(n_runs):
+            run, pos = get_varint(buf, pos)
+            runs.append(run)
+        n_filled = sum(runs[0::2])
+
+        if decimals == RAW:
+            values = list(struct.unpack_from(f"<{n_filled}d", buf, pos))
+            pos += 8 * n_filled
+        else:
+            scale, tick, values = 10 ** decimals, 0, []
+            for _ in range(n_filled):
+                delta, pos = get_zigzag(buf, pos)
+                tick += delta
+                values.append(tick / scale)
+
+        prices, it = [], iter(values)
+        for i, run in enumerate(runs):
+            if i % 2: prices.extend([None] * run)
+            else: prices.extend(next(it) for _ in range(run))
+        if len(prices) != slots: raise ValueError(f"corrupt series for {symbol}")
+        shard[symbol] = {"s": start, "p": prices}
+    return shard
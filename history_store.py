@@ -0,0 +1,242 @@
+from startup import lazy_import
+
+# --- HISTORY STORE ---
+# Today's 5 minute series live in one preallocated [symbols x slots] float
+# array per market session (+ a validity mask for gaps) instead of a dict of
+# Python lists. Fresh candles are written straight into their slots, so
+# nothing is rebuilt between runs; {s, p} dicts are only produced when the
+# shards are serialized.
+
+# Extra slots kept around the regular session (late/early candles)
+SESSION_SLACK = 60 * 60
+
+# Hard bound per symbol: one local day of slots
+DAY_SECONDS = 24 * 60 * 60
+
+class SessionGrid:
+    """Prices of one market for one local day, one row per symbol."""
+
+    def __init__(self, origin, slots, step, capacity):
+        np = lazy_import("numpy")
+        self.origin = origin  # Epoch seconds of slot 0
+        self.step = step
+        self.values = np.full((max(capacity, 1), slots), np.nan)
+        self.valid = np.zeros((max(capacity, 1), slots), dtype=bool)
+        self.rows = {}
+        self.free = []
+
+    @property
+    def slots(self):
+        return self.values.shape[1]
+
+    def row_for(self, symbol):
+        row = self.rows.get(symbol)
+        if row is not None: return row
+
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = len(self.rows)
+            if row >= self.values.shape[0]: self._grow_rows()
+        self.rows[symbol] = row
+        return row
+
+    def _grow_rows(self):
+        np = lazy_import("numpy")
+        extra = self.values.shape[0]
+        self.values = np.vstack([self.values, np.full((extra, self.slots), np.nan)])
+        self.valid = np.vstack([self.valid, np.zeros((extra, self.slots), dtype=bool)])
+
+    def extend(self, first_slot, last_slot):
+        """Widens the grid (never past the local day) so both slots fit."""
+        np = lazy_import("numpy")
+        before = max(-first_slot, 0)
+        after = max(last_slot + 1 - self.slots, 0)
+        if not before and not after: return 0
+
+        n = self.values.shape[0]
+        self.values = np.hstack([np.full((n, before), np.nan), self.values, np.full((n, after), np.nan)])
+        self.valid = np.hstack([np.zeros((n, before), bool), self.valid, np.zeros((n, after), bool)])
+        self.origin -= before * self.step
+        return before
+
+    def clear(self, symbol):
+        row = self.rows.get(symbol)
+        if row is None: return
+        self.values[row] = lazy_import("numpy").nan
+        self.valid[row] = False
+
+    def release(self, symbol):
+        row = self.rows.pop(symbol, None)
+        if row is None: return
+        self.values[row] = lazy_import("numpy").nan
+        self.valid[row] = False
+        self.free.append(row)
+
+    def nbytes(self):
+        return self.values.nbytes + self.valid.nbytes
+
+class HistoryStore:
+    """Columnar home of every symbol's intraday series.
+
+    Grids are keyed by (market session, local midnight). Reads return the
+    same {s, p} dicts the history shards always held.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.grids = {}   # (session key, day start) -> SessionGrid
+        self.where = {}   # symbol -> grid key
+        self.capacity = {}
+
+    def reserve(self, session_key, symbols):
+        """Row capacity to preallocate for a market (its symbol count)."""
+        self.capacity[session_key] = symbols
+
+    def _grid(self, session_key, day_start, window):
+        key = (session_key, day_start)
+        grid = self.grids.get(key)
+        if grid is None:
+            opens, closes = window
+            first = max(opens - SESSION_SLACK, 0)
+            last = min(closes + SESSION_SLACK, DAY_SECONDS)
+            origin = day_start + first - first % self.step
+            slots = -(-(day_start + last - origin) // self.step)
+            grid = SessionGrid(origin, slots, self.step, self.capacity.get(session_key, 16))
+            self.grids[key] = grid
+            self._drop_stale_grids(session_key, day_start)
+        return grid
+
+    def _drop_stale_grids(self, session_key, day_start):
+        """Once a market starts a new day, empty grids of older days are freed."""
+        for key in [k for k, g in self.grids.items() if k[0] == session_key and k[1] < day_start and not g.rows]:
+            del self.grids[key]
+
+    def day_of(self, symbol):
+        key = self.where.get(symbol)
+        return key[1] if key else None
+
+    def write(self, symbol, session_key, day_start, window, start, values, overlay=False):
+        """Puts `values` (NaN = gap) into the slots starting at epoch `start`.
+
+        overlay=True keeps earlier slots of the same day (incremental fetch),
+        otherwise the symbol's row starts from scratch.
+        """
+        np = lazy_import("numpy")
+        key = (session_key, day_start)
+        old = self.where.get(symbol)
+        if old is not None and old != key:
+            self.grids[old].release(symbol)
+            if not self.grids[old].rows: self._drop_stale_grids(session_key, day_start)
+
+        grid = self._grid(session_key, day_start, window)
+        row = grid.row_for(symbol)
+        if not overlay: grid.clear(symbol)
+        self.where[symbol] = key
+
+        first = (start - grid.origin) // self.step
+        first += grid.extend(first, first + len(values) - 1)
+        ok = ~np.isnan(values)
+        grid.values[row, first:first + len(values)][ok] = values[ok]
+        grid.valid[row, first:first + len(values)] |= ok
+
+    def get(self, symbol, default=None):
+        """{s, p} of a symbol (None for gaps), or `default`."""
+        np = lazy_import("numpy")
+        key = self.where.get(symbol)
+        if key is None: return default
+        grid = self.grids[key]
+        row = grid.rows[symbol]
+
+        filled = np.flatnonzero(grid.valid[row])
+        if not len(filled): return default
+        first, last = filled[0], filled[-1] + 1
+        prices = grid.values[row, first:last].tolist()
+        mask = grid.valid[row, first:last].tolist()
+        return {
+            "s": int(grid.origin + first * self.step),
+            "p": [p if ok else None for p, ok in zip(prices, mask)]
+        }
+
+    def put(self, symbol, session_key, day_start, window, series):
+        """Loads a published {s, p} series back into the store."""
+        np = lazy_import("numpy")
+        values = np.array([np.nan if p is None else p for p in series["p"]], dtype=float)
+        self.write(symbol, session_key, day_start, window, series["s"], values)
+
+    def retain(self, symbols):
+        """Forgets symbols that are no longer in stock_profiles."""
+        keep = set(symbols)
+        for symbol in [s for s in self.where if s not in keep]:
+            self.grids[self.where.pop(symbol)].release(symbol)
+
+    def __contains__(self, symbol):
+        return symbol in self.where
+
+    def __len__(self):
+        return len(self.where)
+
+    def items(self):
+        for symbol in list(self.where):
+            series = self.get(symbol)
+            if series is not None: yield symbol, series
+
+    def hours(self):
+        """(session key, day start, hour, hour start, {symbol: prices}) per hour a grid covers.
+
+        `hour` counts hours since the grid's local midnight; symbols without a
+        price in that hour are left out, gaps are None.
+        """
+        np = lazy_import("numpy")
+        per_hour = 3600 // self.step
+        for (session_key, day_start), grid in self.grids.items():
+            if not grid.rows: continue
+            symbols = list(grid.rows)
+            rows = np.array([grid.rows[s] for s in symbols])
+            first_hour = (grid.origin - day_start) // 3600
+            last_hour = (grid.origin + grid.slots * self.step - 1 - day_start) // 3600
+            for hour in range(first_hour, last_hour + 1):
+                start = day_start + hour * 3600
+                lo = (start - grid.origin) // self.step
+                cols = slice(max(lo, 0), max(lo + per_hour, 0))
+                valid = grid.valid[rows, cols]
+                filled = valid.any(axis=1)
+                if not filled.any(): continue
+                # Pad the hour's first slots that fall before the grid origin
+                pad = [None] * max(-lo, 0)
+                values = grid.values[rows, cols].tolist()
+                series = {
+                    symbols[i]: pad + [p if ok else None for p, ok in zip(values[i], valid[i].tolist())]
+                    for i in np.flatnonzero(filled)
+                }
+                yield session_key, day_start, hour, start, series
+
+    def bars(self, step=None):
+        """(symbol, bar starts, closes): the last price in every `step` bucket.
+
+        step=None gives one bar per local day, stamped with the day start.
+        """
+        np = lazy_import("numpy")
+        for (session_key, day_start), grid in self.grids.items():
+            if not grid.rows: continue
+            times = grid.origin + np.arange(grid.slots) * self.step
+            buckets = np.full(grid.slots, day_start) if step is None else times - times % step
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+            symbols = list(grid.rows)
+            rows = np.array([grid.rows[s] for s in symbols])
+            # Index of the last filled slot per bucket (-1 = empty bucket)
+            last = np.where(grid.valid[rows], np.arange(grid.slots), -1)
+            last = np.maximum.reduceat(last, starts, axis=1)
+            for i, symbol in enumerate(symbols):
+                ok = last[i] >= 0
+                if ok.any(): yield symbol, buckets[starts][ok], grid.values[rows[i], last[i][ok]]
+
+    def report(self):
+        total = sum(g.nbytes() for g in self.grids.values())
+        per_symbol = total / len(self.where) if self.where else 0
+        bound = -(-DAY_SECONDS // self.step) * 9  # float64 value + bool mask per slot
+        print(
+            f"🗄️ History store: {len(self.where)} symbols in {len(self.grids)} grids | "
+            f"{total / 1024:.0f} KB ({per_symbol:.0f} B/symbol, bound {bound} B)"
+        )
@@ -0,0 +1,186 @@
+from datetime import datetime, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# --- SESSION CALENDAR ---
+# Regular trading hours per exchange in local time. Holidays are full-day
+# closures taken from the exchange calendars (extend the lists every year).
+SESSIONS = {
+    "US": {
+        "tz": "America/New_York", "open": dtime(9, 30), "close": dtime(16, 0),
+        "holidays": {
+            "2026-01-01", "2026-01-19", "2026-02-16", "2026-04-03", "2026-05-25",
+            "2026-06-19", "2026-07-03", "2026-09-07", "2026-11-26", "2026-12-25",
+        },
+    },
+    "INDIA": {
+        "tz": "Asia/Kolkata", "open": dtime(9, 15), "close": dtime(15, 30),
+        # Fixed-date NSE holidays only; lunar ones come from the yearly NSE circular
+        "holidays": {
+            "2026-01-26", "2026-04-03", "2026-05-01", "2026-10-02", "2026-12-25",
+        },
+    },
+    "UK": {
+        "tz": "Europe/London", "open": dtime(8, 0), "close": dtime(16, 30),
+        "holidays": {
+            "2026-01-01", "2026-04-03", "2026-04-06", "2026-05-04", "2026-05-25",
+            "2026-08-31", "2026-12-25", "2026-12-28",
+        },
+    },
+    "GERMANY": {
+        "tz": "Europe/Berlin", "open": dtime(9, 0), "close": dtime(17, 30),
+        "holidays": {
+            "2026-01-01", "2026-04-03", "2026-04-06", "2026-05-01", "2026-12-24",
+            "2026-12-25", "2026-12-31",
+        },
+    },
+    "FRANCE": {
+        "tz": "Europe/Paris", "open": dtime(9, 0), "close": dtime(17, 30),
+        "holidays": {
+            "2026-01-01", "2026-04-03", "2026-04-06", "2026-05-01", "2026-12-25",
+        },
+    },
+    "JAPAN": {
+        "tz": "Asia/Tokyo", "open": dtime(9, 0), "close": dtime(15, 30),
+        "holidays": set(),
+    },
+    "HONGKONG": {
+        "tz": "Asia/Hong_Kong", "open": dtime(9, 30), "close": dtime(16, 0),
+        "holidays": set(),
+    },
+    # Index-only exchanges (INDEX_SESSIONS); lunar holidays come from the
+    # yearly exchange circulars like the INDIA ones
+    "AUSTRALIA": {
+        "tz": "Australia/Sydney", "open": dtime(10, 0), "close": dtime(16, 0),
+        "holidays": {
+            "2026-01-01", "2026-01-26", "2026-04-03", "2026-04-06", "2026-06-08",
+            "2026-12-25", "2026-12-28",
+        },
+    },
+    "KOREA": {
+        "tz": "Asia/Seoul", "open": dtime(9, 0), "close": dtime(15, 30),
+        "holidays": {"2026-01-01", "2026-05-05", "2026-10-09", "2026-12-25", "2026-12-31"},
+    },
+    "TAIWAN": {
+        "tz": "Asia/Taipei", "open": dtime(9, 0), "close": dtime(13, 30),
+        "holidays": {"2026-01-01"},
+    },
+    "CHINA": {
+        "tz": "Asia/Shanghai", "open": dtime(9, 30), "close": dtime(15, 0),
+        "holidays": {"2026-01-01", "2026-05-01", "2026-10-01", "2026-10-02"},
+    },
+    "SWITZERLAND": {
+        "tz": "Europe/Zurich", "open": dtime(9, 0), "close": dtime(17, 30),
+        "holidays": {
+            "2026-01-01", "2026-01-02", "2026-04-03", "2026-04-06", "2026-05-01",
+            "2026-05-14", "2026-05-25", "2026-12-24", "2026-12-25", "2026-12-31",
+        },
+    },
+    "CANADA": {
+        "tz": "America/Toronto", "open": dtime(9, 30), "close": dtime(16, 0),
+        "holidays": {
+            "2026-01-01", "2026-02-16", "2026-04-03", "2026-05-18", "2026-07-01",
+            "2026-08-03", "2026-09-07", "2026-10-12", "2026-12-25", "2026-12-28",
+        },
+    },
+    "BRAZIL": {
+        # B3 closes at 17:00 or 18:00 depending on US daylight saving time
+        "tz": "America/Sao_Paulo", "open": dtime(10, 0), "close": dtime(18, 0),
+        "holidays": {
+            "2026-01-01", "2026-02-16", "2026-02-17", "2026-04-03", "2026-04-21",
+            "2026-05-01", "2026-06-04", "2026-09-07", "2026-10-12", "2026-11-02",
+            "2026-11-20", "2026-12-24", "2026-12-25", "2026-12-31",
+        },
+    },
+    "MEXICO": {
+        "tz": "America/Mexico_City", "open": dtime(8, 30), "close": dtime(15, 0),
+        "holidays": {
+            "2026-01-01", "2026-02-02", "2026-03-16", "2026-04-02", "2026-04-03",
+            "2026-05-01", "2026-09-16", "2026-11-16", "2026-12-25",
+        },
+    },
+}
+
+# INDEX rows mix exchanges, so each index follows its home session
+INDEX_SESSIONS = {
+    "^GSPC": "US", "^DJI": "US", "^IXIC": "US", "^RUT": "US", "^VIX": "US",
+    "^NSEI": "INDIA", "^BSESN": "INDIA",
+    "^FTSE": "UK", "^GDAXI": "GERMANY", "^FCHI": "FRANCE",
+    "^STOXX50E": "GERMANY",  # Calculated over Xetra/Eurex hours
+    "^SSMI": "SWITZERLAND",
+    "^N225": "JAPAN", "^HSI": "HONGKONG", "^AXJO": "AUSTRALIA",
+    "^KS11": "KOREA", "^TWII": "TAIWAN", "000001.SS": "CHINA",
+    "^GSPTSE": "CANADA", "^BVSP": "BRAZIL", "^MXX": "MEXICO",
+}
+
+# Yahoo can publish the last candles a few minutes after the bell
+CLOSE_GRACE = timedelta(minutes=15)
+
+# A watermark this close to the bell counts as the session's final bar
+FINAL_BAR_TOLERANCE = timedelta(minutes=30)
+
+def resolve_market(symbol, market):
+    """Market label for a symbol, auto-detecting crypto if the DB says US."""
+    if (market == 'US') and ('-USD' in symbol or 'BTC' in symbol or 'ETH' in symbol):
+        return 'CRYPTO'
+    return market
+
+def session_for(symbol, market):
+    """SESSIONS key for a symbol, or None if it trades around the clock / is unknown."""
+    market = resolve_market(symbol, market)
+    if market == 'INDEX':
+        return INDEX_SESSIONS.get(symbol)
+    return market if market in SESSIONS else None
+
+def exchange_tz(symbol, market):
+    """IANA timezone of the symbol's home exchange, or None for 24/7 / unknown markets."""
+    session_key = session_for(symbol, market)
+    return SESSIONS[session_key]["tz"] if session_key else None
+
+def session_window(symbol, market):
+    """(session key, (open, close) as seconds after local midnight) for a symbol.
+
+    24/7 and unknown markets share the "24/7" key and span the whole day.
+    """
+    session_key = session_for(symbol, market)
+    if session_key is None: return "24/7", (0, 24 * 60 * 60)
+    session = SESSIONS[session_key]
+    seconds = lambda t: t.hour * 3600 + t.minute * 60
+    return session_key, (seconds(session["open"]), seconds(session["close"]))
+
+def is_trading_day(session, day):
+    return day.weekday() < 5 and day.isoformat() not in session["holidays"]
+
+def is_open(session_key, now=None):
+    """True while the exchange is in regular hours (plus CLOSE_GRACE)."""
+    if session_key is None: return True
+    session = SESSIONS[session_key]
+    local = (now or datetime.now(timezone.utc)).astimezone(ZoneInfo(session["tz"]))
+    if not is_trading_day(session, local.date()): return False
+
+    opens = datetime.combine(local.date(), session["open"], local.tzinfo)
+    closes = datetime.combine(local.date(), session["close"], local.tzinfo)
+    return opens <= local <= closes + CLOSE_GRACE
+
+def last_close(session_key, now=None):
+    """Most recent session close (UTC datetime) that is already in the past."""
+    session = SESSIONS[session_key]
+    tz = ZoneInfo(session["tz"])
+    local = (now or datetime.now(timezone.utc)).astimezone(tz)
+
+    day = local.date()
+    for _ in range(14):
+        closes = datetime.combine(day, session["close"], tz)
+        if is_trading_day(session, day) and closes <= local:
+            return closes.astimezone(timezone.utc)
+        day -= timedelta(days=1)
+    return None
+
+def should_fetch(symbol, market, watermark, now=None):
+    """Skip symbols whose exchange is closed and that already hold the final bar."""
+    session_key = session_for(symbol, market)
+    if is_open(session_key, now): return True
+    if not watermark: return True
+
+    closes = last_close(session_key, now)
+    if closes is None: return True
+    return watermark["t"] < (closes - FINAL_BAR_TOLERANCE).timestamp()
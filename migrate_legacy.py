@@ -0,0 +1,333 @@
+"""Streams legacy data files into the formats the scraper publishes today.
+
+    python migrate_legacy.py history.json data/latest_prices.json --out migrated
+    python migrate_legacy.py archive/*.json --format json,binary,columnar
+
+Inputs are recognized by their shape:
+    {"SYM": [[ts, price], ...], ...}           old history.json pair format
+    [{"symbol": ..., "chart_data": [...]}, ...] old data/latest_prices.json
+                                                (NaN literals, chart_data)
+
+Outputs in --out:
+    json      history_NN.json ({s, p} shards, same ring as the scraper)
+              + latest_prices.json
+    binary    history_NN.bin (history_codec.py)
+    columnar  symbols.json + latest_columns.json
+
+Files are parsed one top-level element at a time and written out as they
+come, so memory is bounded by the largest single series or row (plus the
+symbol table for columnar output), not by the archive size. NaN / Infinity become null; the first input that has a symbol
+wins. Drop the output into the repo root and the next scrape picks it up.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+from datetime import datetime
+from scraper import HISTORY_SHARDS, RESAMPLE_SECONDS
+from publish import ShardRing, digest
+from markets import resolve_market
+from quotes import Quote, quote_json, NUMBER_COLUMNS, SYMBOLS_FILE, COLUMNS_FILE
+import history_codec
+
+# Characters read per refill; long elements are read in doubling steps
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = ("json", "binary", "columnar")
+
+# --- STREAMING PARSER ---
+
+class JsonStream:
+    """A top-level JSON array / object read one element at a time.
+
+    Each element is handed to json's raw_decode, which (like the writer that
+    produced these files) accepts NaN and Infinity.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.peak = 0  # Largest buffer held, for the report
+
+    def _more(self, size):
+        if self.eof: return False
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.peak = max(self.peak, len(self.buf))
+        return True
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if not self._more(self.chunk_size): return ""
+
+    def _expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"expected one of {chars!r} at offset {self.pos}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def _value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number cut at the chunk edge still parses: only trust it if something follows
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof: raise
+            # Doubling keeps re-parsing a long element linear overall
+            self._more(size)
+            size *= 2
+
+    def items(self):
+        """(key, value) pairs of a top-level object."""
+        self._expect("{")
+        if self.peek() == "}": return
+        while True:
+            key = self._value()
+            self._expect(":")
+            yield key, self._value()
+            if self._expect(",}") == "}": return
+
+    def elements(self):
+        """Values of a top-level array."""
+        self._expect("[")
+        if self.peek() == "]": return
+        while True:
+            yield self._value()
+            if self._expect(",]") == "]": return
+
+# --- CONVERSION ---
+
+def finite(x, digits=2):
+    """Rounded number, or None for NaN / Infinity / missing."""
+    if not isinstance(x, (int, float)) or x != x or x in (float("inf"), float("-inf")): return None
+    return round(x, digits)
+
+def pairs_to_series(pairs, step=RESAMPLE_SECONDS):
+    """[[ts, price], ...] -> {s, p} on the step grid (off-grid points dropped, like asfreq)."""
+    points = {}
+    for t, price in pairs:
+        price = finite(price)
+        if price is None or int(t) % step: continue
+        points[int(t)] = price
+    if not points: return None
+    first, last = min(points), max(points)
+    return {"s": first, "p": [points.get(t) for t in range(first, last + 1, step)]}
+
+def chart_to_series(row):
+    """chart_data of an old latest_prices row: 5 minute closes from market_open_ts."""
+    chart, start = row.get("chart_data"), row.get("market_open_ts")
+    if not chart or not start: return None
+    prices = [finite(x) for x in chart]
+    if not any(p is not None for p in prices): return None
+    return {"s": int(start), "p": prices}
+
+def row_to_quote(row):
+    symbol = row["symbol"]
+    return Quote(
+        symbol,
+        row.get("company_name") or symbol,
+        resolve_market(symbol, row.get("market") or "US"),
+        finite(row.get("price")),
+        finite(row.get("change_percent")),
+        finite(row.get("change_value")),
+        row.get("recorded_at") or row.get("last_updated"),
+        finite(row.get("previous_close"))
+    )
+
+# --- WRITERS ---
+
+class HistoryWriter:
+    """history_NN.json / .bin shards, appended to entry by entry."""
+
+    def __init__(self, out, ring, formats):
+        self.out = out
+        self.names = ring.names()
+        self.ring = ring
+        self.formats = formats
+        self.json = {}
+        self.bin = {}
+        self.counts = {}
+        self.last_start = {}
+
+    def add(self, symbol, series):
+        name = self.names[self.ring.shard_of(symbol)]
+        if "json" in self.formats:
+            f = self.json.get(name)
+            if f is None:
+                f = self.json[name] = open(os.path.join(self.out, f"{name}.json"), 'w')
+                f.write("{")
+            else:
+                f.write(",")
+            f.write(json.dumps(symbol) + ":" + json.dumps(series, separators=(',', ':')))
+        if "binary" in self.formats:
+            f = self.bin.get(name)
+            if f is None: f = self.bin[name] = open(os.path.join(self.out, f"{name}.bin.part"), 'wb')
+            f.write(history_codec.encode_series(symbol, series, self.last_start.get(name, 0)))
+            self.last_start[name] = series["s"]
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def close(self):
+        for name in self.names:
+            if "json" in self.formats:
+                f = self.json.pop(name, None)
+                if f is None:
+                    f = open(os.path.join(self.out, f"{name}.json"), 'w')
+                    f.write("{")
+                f.write("}")
+                f.close()
+            if "binary" in self.formats:
+                # Record count goes in the header, so the body is copied in behind it
+                part = os.path.join(self.out, f"{name}.bin.part")
+                body = self.bin.pop(name, None)
+                if body is not None: body.close()
+                with open(os.path.join(self.out, f"{name}.bin"), 'wb') as f:
+                    f.write(history_codec.header(self.counts.get(name, 0)))
+                    if body is not None:
+                        with open(part, 'rb') as src: shutil.copyfileobj(src, f)
+                        os.remove(part)
+
+class QuoteWriter:
+    """latest_prices.json and/or the columnar pair, one quote at a time.
+
+    The columnar pair is in symbol order like the scraper's (quotes.py): the
+    static table is held in memory, the numbers wait in a spill file as one
+    JSON line per quote and are read back by offset once the order is known.
+    """
+
+    COLUMNS = NUMBER_COLUMNS + ("t",)
+
+    def __init__(self, out, formats):
+        self.out = out
+        self.formats = formats
+        self.count = 0
+        self.latest = open(os.path.join(out, "latest_prices.json"), 'w') if "json" in formats else None
+        self.table = []  # (symbol, company_name, market, spill offset)
+        self.spill = open(os.path.join(out, "numbers.part"), 'w+b') if "columnar" in formats else None
+
+    def add(self, quote):
+        sep = ", " if self.count else "["
+        if self.latest: self.latest.write(sep + quote_json(quote))
+        if self.spill:
+            t = int(datetime.fromisoformat(quote.recorded_at).timestamp()) if quote.recorded_at else None
+            self.table.append((quote.symbol, quote.company_name, quote.market, self.spill.tell()))
+            values = [getattr(quote, column) for column in NUMBER_COLUMNS] + [t]
+            self.spill.write(json.dumps(values).encode() + b"\n")
+        self.count += 1
+
+    def close(self):
+        if self.latest:
+            self.latest.write("]" if self.count else "[]")
+            self.latest.close()
+        if not self.spill: return
+
+        # symbols.json first: its hash is the "v" latest_columns.json points at
+        self.table.sort()
+        table = {
+            "symbol": [row[0] for row in self.table],
+            "company_name": [row[1] for row in self.table],
+            "market": [row[2] for row in self.table]
+        }
+        table_bytes = json.dumps(table, separators=(',', ':')).encode()
+        with open(os.path.join(self.out, SYMBOLS_FILE), 'wb') as f:
+            f.write(table_bytes)
+        del table
+
+        # Numbers back in symbol order, one part file per column
+        parts = {column: open(os.path.join(self.out, f"{column}.column.part"), 'w+') for column in self.COLUMNS}
+        for i, (*_, offset) in enumerate(self.table):
+            self.spill.seek(offset)
+            values = json.loads(self.spill.readline())
+            for column, value in zip(self.COLUMNS, values):
+                parts[column].write(("," if i else "") + json.dumps(value))
+        self.spill.close()
+        os.remove(os.path.join(self.out, "numbers.part"))
+
+        with open(os.path.join(self.out, COLUMNS_FILE), 'w') as f:
+            f.write(f'{{"v":"{digest(table_bytes)[:12]}"')
+            for column, part in parts.items():
+                f.write(f',"{column}":[')
+                part.seek(0)
+                shutil.copyfileobj(part, f, CHUNK_SIZE)
+                part.close()
+                os.remove(os.path.join(self.out, f"{column}.column.part"))
+                f.write("]")
+            f.write("}")
+
+# --- DRIVER ---
+
+def migrate(paths, out, formats=("json",), shards=HISTORY_SHARDS):
+    """Converts every input file; returns {"series", "quotes", "peak"} counts."""
+    os.makedirs(out, exist_ok=True)
+    history = HistoryWriter(out, ShardRing(shards), formats)
+    quotes = QuoteWriter(out, formats)
+    seen_series, seen_quotes = set(), set()
+    peak = 0
+
+    def add_series(symbol, series):
+        if series is None or symbol in seen_series: return
+        seen_series.add(symbol)
+        history.add(symbol, series)
+
+    try:
+        for path in paths:
+            with open(path) as f:
+                stream = JsonStream(f)
+                kind = stream.peek()
+                if kind == "{":
+                    print(f"📜 {path}: legacy [[ts, price]] history")
+                    for symbol, pairs in stream.items():
+                        add_series(symbol, pairs_to_series(pairs))
+                elif kind == "[":
+                    print(f"📜 {path}: legacy latest prices")
+                    for row in stream.elements():
+                        if not isinstance(row, dict) or "symbol" not in row: continue
+                        add_series(row["symbol"], chart_to_series(row))
+                        if row["symbol"] in seen_quotes: continue
+                        seen_quotes.add(row["symbol"])
+                        quotes.add(row_to_quote(row))
+                else:
+                    print(f"⚠️ {path}: not a legacy data file, skipped")
+                peak = max(peak, stream.peak)
+    finally:
+        history.close()
+        quotes.close()
+    return {"series": len(seen_series), "quotes": len(seen_quotes), "peak": peak}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert legacy history / latest price files")
+    parser.add_argument("paths", nargs="+", help="legacy JSON files (history.json, data/latest_prices.json, ...)")
+    parser.add_argument("--out", default="migrated", help="output directory")
+    parser.add_argument("--format", default="json", help=f"comma separated: {', '.join(FORMATS)}")
+    parser.add_argument("--shards", type=int, default=HISTORY_SHARDS, help="history shard count")
+    args = parser.parse_args()
+
+    formats = tuple(f.strip() for f in args.format.split(",") if f.strip())
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown: sys.exit(f"❌ Unknown format(s): {', '.join(unknown)}")
+
+    t0 = time.perf_counter()
+    stats = migrate(args.paths, args.out, formats, args.shards)
+    print(
+        f"✅ {stats['series']} series, {stats['quotes']} quotes -> {args.out} "
+        f"in {time.perf_counter() - t0:.2f}s (largest parse buffer {stats['peak'] / 1024:.0f} KB)"
+    )
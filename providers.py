@@ -0,0 +1,242 @@
+import os
+import json
+import glob
+import logging
+import threading
+from startup import lazy_import
+
+# ⚡ HTTP POOL SETTING ⚡
+# yf.download(threads=True) runs up to 2 threads per CPU, so the keep-alive
+# pool is sized to match unless overridden
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", (os.cpu_count() or 1) * 2))
+
+# --- HTTP SESSION ---
+
+class SessionStats:
+    """Connection counters for the shared Yahoo session."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0     # Connection acquires (one per request)
+        self.handshakes = 0   # New TCP/TLS connections actually opened
+
+    def count(self, handshakes=0):
+        with self.lock:
+            self.requests += 1
+            self.handshakes += handshakes
+
+    def opened(self):
+        """One new connection (counted where it is made, so threads can't overlap)."""
+        with self.lock:
+            self.handshakes += 1
+
+    def report(self):
+        reused = self.requests - self.handshakes
+        print(f"🔌 HTTP pool: {self.requests} requests, {self.handshakes} handshakes, {reused} reused connections")
+
+def make_session(pool_size=HTTP_POOL_SIZE):
+    """One keep-alive session for every Yahoo call of the run.
+
+    Newer yfinance only accepts curl_cffi sessions (browser impersonation);
+    older ones take a plain requests.Session with a sized urllib3 pool.
+    """
+    stats = SessionStats()
+
+    try:
+        curl_requests = lazy_import("curl_cffi.requests")
+        CurlInfo = lazy_import("curl_cffi.const").CurlInfo
+
+        class PooledSession(curl_requests.Session):
+            def request(self, *args, **kwargs):
+                response = super().request(*args, **kwargs)
+                try: handshakes = int(response.curl.getinfo(CurlInfo.NUM_CONNECTS))
+                except Exception: handshakes = 0
+                stats.count(handshakes)
+                return response
+
+        session = PooledSession(impersonate="chrome")
+    except ImportError:
+        requests = lazy_import("requests")
+        HTTPAdapter = lazy_import("requests.adapters").HTTPAdapter
+        connectionpool = lazy_import("urllib3.connectionpool")
+
+        class PooledSession(requests.Session):
+            def request(self, *args, **kwargs):
+                response = super().request(*args, **kwargs)
+                stats.count()
+                return response
+
+        # Handshakes are counted per connection the pools open
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    stats.opened()
+                    return super()._new_conn()
+            return CountingPool
+
+        session = PooledSession()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            "http": counting(connectionpool.HTTPConnectionPool),
+            "https": counting(connectionpool.HTTPSConnectionPool),
+        }
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    session.stats = stats
+    return session
+
+# --- YFINANCE ERRORS ---
+# yfinance swallows per-ticker failures (429s included) and only logs them:
+# 1.x keeps the table per download call, older versions in yf.shared._ERRORS.
+# The log records are the one place both versions report them.
+
+class ErrorLog(logging.Handler):
+    """Error records of the `yfinance` logger, per calling thread."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.records = {}
+
+    def emit(self, record):
+        try: message = record.getMessage()
+        except Exception: message = str(record.msg)
+        self.records.setdefault(threading.get_ident(), []).append(message)
+
+    def reset(self):
+        self.records.pop(threading.get_ident(), None)
+
+    def messages(self):
+        return list(self.records.get(threading.get_ident(), []))
+
+_error_log = None
+
+def yfinance_errors():
+    """The shared ErrorLog, attached to the yfinance logger on first use."""
+    global _error_log
+    if _error_log is None:
+        _error_log = ErrorLog()
+        logging.getLogger("yfinance").addHandler(_error_log)
+    return _error_log
+
+# --- MARKET DATA PROVIDERS ---
+# Everything the scraper needs from Yahoo goes through one of these, so a run
+# can be recorded once and replayed offline (profiling / regression checks).
+
+class YahooProvider:
+    """Live candles from yf.download over one pooled keep-alive session."""
+
+    offline = False
+
+    def __init__(self, session=None):
+        self.session = session or make_session()
+        self.errors = yfinance_errors()
+
+    def download(self, symbols, **window):
+        yf = lazy_import("yfinance")
+        self.errors.reset()
+        return yf.download(
+            " ".join(symbols),
+            interval="5m",
+            progress=False,
+            group_by='ticker',
+            threads=True,
+            auto_adjust=False,
+            session=self.session,
+            **window
+        )
+
+    def report(self):
+        self.session.stats.report()
+
+    def last_errors(self):
+        """Errors yfinance swallowed during this thread's last download."""
+        yf = lazy_import("yfinance")
+        errors = dict(getattr(getattr(yf, "shared", None), "_ERRORS", None) or {})
+        for i, message in enumerate(self.errors.messages()):
+            errors[f"log{i}"] = message
+        return errors
+
+class RecordingProvider:
+    """Wraps another provider and saves every raw frame it returns to `directory`."""
+
+    offline = False
+
+    def __init__(self, directory, inner=None):
+        self.directory = directory
+        self.inner = inner or YahooProvider()
+        self.lock = threading.Lock()
+        self.seq = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def download(self, symbols, **window):
+        data = self.inner.download(symbols, **window)
+        with self.lock:
+            self.seq += 1
+            name = f"{self.seq:05d}"
+        data.to_pickle(os.path.join(self.directory, f"{name}.pkl"))
+        with open(os.path.join(self.directory, f"{name}.json"), 'w') as f:
+            json.dump({"symbols": list(symbols), "window": {k: str(v) for k, v in window.items()}}, f)
+        return data
+
+    def last_errors(self):
+        return self.inner.last_errors()
+
+    def report(self):
+        self.inner.report()
+
+    def save_profiles(self, all_stocks):
+        with open(os.path.join(self.directory, "profiles.json"), 'w') as f:
+            json.dump(all_stocks, f)
+
+class ReplayProvider:
+    """Serves recorded frames back without touching the network.
+
+    Recordings are split into per-symbol frames, so any batch can be served
+    no matter how the (adaptive) batcher groups symbols on replay. Results
+    are deterministic for a given recording directory.
+    """
+
+    offline = True
+
+    def __init__(self, directory):
+        pd = lazy_import("pandas")
+        self.directory = directory
+        self.frames = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*.pkl"))):
+            with open(path[:-4] + ".json") as f:
+                symbols = json.load(f)["symbols"]
+            data = pd.read_pickle(path)
+            if data.empty: continue
+            if data.columns.nlevels == 1:
+                self.frames[symbols[0]] = data
+            else:
+                for symbol in symbols:
+                    if symbol in data.columns.levels[0]:
+                        self.frames[symbol] = data[symbol]
+        print(f"📼 Replaying {len(self.frames)} recorded symbols from {directory}")
+
+    def download(self, symbols, **window):
+        pd = lazy_import("pandas")
+        found = {s: self.frames[s] for s in symbols if s in self.frames}
+        if not found: return pd.DataFrame()
+        # Same layout yf.download(group_by='ticker') produces, (Ticker, Price)
+        # columns even for a single ticker
+        return pd.concat(found, axis=1)
+
+    def last_errors(self):
+        return {}
+
+    def report(self):
+        pass
+
+    def load_profiles(self):
+        with open(os.path.join(self.directory, "profiles.json")) as f:
+            return json.load(f)
+
+def make_provider(spec):
+    """'yahoo', 'record:<dir>' or 'replay:<dir>' -> provider instance."""
+    kind, _, directory = spec.partition(":")
+    if kind == "record": return RecordingProvider(directory or "recordings")
+    if kind == "replay": return ReplayProvider(directory or "recordings")
+    return YahooProvider()
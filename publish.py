@@ -0,0 +1,308 @@
+import os
+import gzip
+import bisect
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from startup import lazy_import
+from markets import SESSIONS
+
+# --- CHANGE-ONLY PUBLISHING ---
+# Every output file is rendered to its canonical bytes and hashed. Files whose
+# hash matches the previous run are not touched at all, so a run where only a
+# few markets moved rewrites (and the workflow commits) only those shards.
+# manifest.json lists every published file's hash plus what this run changed.
+
+MANIFEST_FILE = "manifest.json"
+
+# Points appended/revised by the latest run, for clients that poll
+DELTA_FILE = "history_delta.json"
+
+# ⚡ PRECOMPRESS SETTING ⚡
+# Every changed file also gets .gz / .br siblings so the edge serves
+# precompressed bytes. Max levels: a file is compressed once, served many times.
+# Without the `brotli` package only .gz siblings are written.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+COMPRESS_WORKERS = os.cpu_count() or 1
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def write_atomic(path, data):
+    """Write-then-rename so a reader never sees a half written file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def load_brotli():
+    try:
+        return lazy_import("brotli")
+    except ImportError:
+        return None
+
+def compress(data, brotli):
+    """{suffix: bytes} for one file. gzip with mtime=0 so equal input gives equal bytes."""
+    out = {"gz": gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None: out["br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return out
+
+class Publisher:
+    """Writes output files only when their bytes changed since the last run."""
+
+    def __init__(self, manifest_path=MANIFEST_FILE):
+        self.manifest_path = manifest_path
+        try:
+            with open(manifest_path) as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            self.previous = {}
+        self.files = self.previous.get("files", {})
+        self.meta = {k: v for k, v in self.previous.items() if k not in ("updated_at", "changed", "removed", "files")}
+        self.changed = []
+        self.removed = []
+        self.skipped = 0
+        self.bytes_written = 0
+        self.pending = {}  # path -> bytes still to compress
+        self.compressed = {}  # suffix -> [raw bytes, compressed bytes] this run
+        self.brotli = load_brotli()
+
+    def unchanged(self, path, sha, record=True):
+        entry = self.files.get(path)
+        if entry is not None:
+            return entry["sha256"] == sha and os.path.exists(path)
+        # Not in the manifest (first run, or not recorded there): compare with what is on disk
+        try:
+            with open(path, 'rb') as f:
+                same = digest(f.read()) == sha
+        except OSError:
+            return False
+        if same and record: self.files[path] = {"sha256": sha, "bytes": os.path.getsize(path)}
+        return same
+
+    def missing_siblings(self, path):
+        suffixes = ["gz", "br"] if self.brotli is not None else ["gz"]
+        return any(not os.path.exists(f"{path}.{suffix}") for suffix in suffixes)
+
+    def write(self, path, data, record=True):
+        """Publishes `data` (bytes) at `path` unless it is already there. True if written.
+
+        record=False keeps the file out of the manifest's file list (for
+        open-ended layouts that would grow it forever).
+        """
+        sha = digest(data)
+        if self.unchanged(path, sha, record):
+            self.skipped += 1
+            # Siblings of files published before precompression existed
+            if self.missing_siblings(path): self.pending[path] = data
+            return False
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        write_atomic(path, data)
+        if record: self.files[path] = {"sha256": sha, "bytes": len(data)}
+        self.changed.append(path)
+        self.bytes_written += len(data)
+        self.pending[path] = data
+        return True
+
+    def compress_pending(self):
+        """Writes .gz/.br siblings of every changed file, in parallel."""
+        if not self.pending: return
+        paths = list(self.pending)
+        # zlib and brotli release the GIL while compressing, so threads scale
+        with ThreadPoolExecutor(max_workers=min(COMPRESS_WORKERS, len(paths))) as pool:
+            results = pool.map(lambda path: compress(self.pending[path], self.brotli), paths)
+            for path, variants in zip(paths, results):
+                for suffix, blob in variants.items():
+                    write_atomic(f"{path}.{suffix}", blob)
+                    if path in self.files: self.files[path][suffix] = len(blob)
+                    sizes = self.compressed.setdefault(suffix, [0, 0])
+                    sizes[0] += len(self.pending[path])
+                    sizes[1] += len(blob)
+        self.pending = {}
+
+    def remove(self, path):
+        """Retires a published file (and its compressed siblings)."""
+        for victim in (path, f"{path}.gz", f"{path}.br"):
+            if os.path.exists(victim): os.remove(victim)
+        self.files.pop(path, None)
+        self.pending.pop(path, None)
+        self.removed.append(path)
+
+    def write_json(self, path, obj, record=True, **kwargs):
+        return self.write(path, json.dumps(obj, **kwargs).encode(), record)
+
+    def save(self):
+        """Compresses what changed, then writes manifest.json (only if something did)."""
+        compressed = bool(self.pending)
+        self.compress_pending()
+        if not self.changed and not self.removed and not compressed: return False
+        manifest = {
+            "updated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "changed": sorted(self.changed),
+            "removed": sorted(self.removed),
+            **self.meta,
+            "files": dict(sorted(self.files.items()))
+        }
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        return True
+
+    def report(self):
+        print(
+            f"🧾 Published {len(self.changed)} changed files ({self.bytes_written / 1024:.0f} KB), "
+            f"skipped {self.skipped} unchanged, removed {len(self.removed)}"
+        )
+        for suffix, (raw, packed) in sorted(self.compressed.items()):
+            print(f"   .{suffix}: {raw / 1024:.0f} KB -> {packed / 1024:.0f} KB ({packed / raw:.0%})")
+        if self.brotli is None and self.compressed:
+            print("   ⚠️ brotli not installed, .br siblings skipped")
+
+# --- HISTORY DELTAS ---
+# history_delta.json carries only what changed in each series since the
+# previous run: {"seq", "base", "t", "d": {symbol: {"s", "o", "p"}}}. A client
+# whose last applied seq equals "base" replaces its points from slot offset
+# "o" on with "p" (a new "s" means a new day: o = 0, the whole series).
+# Any other seq means a missed delta -> resync from the shards; manifest.json
+# says which seq the shards are at ("delta_seq").
+
+def series_delta(old, new):
+    """{s, o, p} turning `old` into `new`, or None if they are equal."""
+    if old is None or old["s"] != new["s"]:
+        return {"s": new["s"], "o": 0, "p": new["p"]}
+    before, after = old["p"], new["p"]
+    o = 0
+    for o, (a, b) in enumerate(zip(before, after)):
+        if a != b: break
+    else:
+        o = min(len(before), len(after))
+        if len(before) == len(after): return None
+    return {"s": new["s"], "o": o, "p": after[o:]}
+
+def publish_delta(publisher, published, current):
+    """Writes history_delta.json with a new seq if any series moved. Returns the point count."""
+    changes = {}
+    for symbol, series in current.items():
+        delta = series_delta(published.get(symbol), series)
+        if delta is not None: changes[symbol] = delta
+    if not changes: return 0
+
+    base = publisher.meta.get("delta_seq", 0)
+    delta = {"seq": base + 1, "base": base, "t": int(time.time()), "d": changes}
+    publisher.write_json(DELTA_FILE, delta, separators=(',', ':'))
+    publisher.meta["delta_seq"] = base + 1
+    return sum(len(d["p"]) for d in changes.values())
+
+# --- HASH SHARDING ---
+# Symbols map to history_NN.json through a consistent-hash ring: each shard
+# owns RING_REPLICAS points, a symbol belongs to the first point after its own
+# hash. Shards come out close in size whatever the ticker alphabet looks like,
+# new symbols never move existing ones, and changing the shard count only
+# moves ~1/N of them. shards.json tells clients which file holds a symbol.
+
+RING_REPLICAS = 256
+SHARD_MANIFEST_FILE = "shards.json"
+
+def ring_hash(key):
+    """Stable 64-bit hash (Python's hash() is salted per process)."""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class ShardRing:
+    """Consistent-hash ring of `count` history shards."""
+
+    def __init__(self, count, replicas=RING_REPLICAS):
+        self.count = count
+        points = sorted((ring_hash(f"shard-{i}#{r}"), i) for i in range(count) for r in range(replicas))
+        self.points = [h for h, _ in points]
+        self.owners = [i for _, i in points]
+
+    def shard_of(self, symbol):
+        i = bisect.bisect(self.points, ring_hash(symbol)) % len(self.points)
+        return self.owners[i]
+
+    def names(self, prefix="history"):
+        return [f"{prefix}_{i:02d}" for i in range(self.count)]
+
+    def split(self, series, prefix="history"):
+        """(symbol, data) pairs -> {shard name: {symbol: data}} (every shard, even empty ones)."""
+        names = self.names(prefix)
+        shards = {name: {} for name in names}
+        for symbol, data in series:
+            shards[names[self.shard_of(symbol)]][symbol] = data
+        return shards
+
+def publish_shard_manifest(publisher, ring, shards):
+    """shards.json: symbol -> shard file, plus every shard's size and hash."""
+    files, symbols = {}, {}
+    for name, shard_data in shards.items():
+        filename = f"{name}.json"
+        entry = publisher.files.get(filename, {})
+        files[filename] = {"symbols": len(shard_data), "bytes": entry.get("bytes"), "sha256": entry.get("sha256")}
+        for symbol in shard_data: symbols[symbol] = filename
+    manifest = {
+        "count": ring.count,
+        "ring": {"hash": "md5[:8]", "replicas": RING_REPLICAS},
+        "files": files,
+        "symbols": dict(sorted(symbols.items()))
+    }
+    publisher.write_json(SHARD_MANIFEST_FILE, manifest, separators=(',', ':'))
+    return [f["bytes"] or 0 for f in files.values()]
+
+# --- HOURLY HISTORY ---
+# Optional CDN-friendly layout: hours/<market>/<local date>/<HH>.json holds
+# one hour of 5 minute points ({"s": hour start, "step": seconds, "d":
+# {symbol: [price | null]}}), HH = hours since the exchange's local midnight.
+# An hour is sealed (never rewritten, cacheable forever) once a run has
+# written it after it was over (plus the re-fetch overlap): a late or failed
+# run can't freeze a copy that is missing the last candles. index.json per day
+# lists the hours, which are sealed and which may still change ("open").
+
+HOURS_DIR = "hours"
+
+def load_index(day_dir):
+    try:
+        with open(os.path.join(day_dir, "index.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def publish_hours(publisher, store, seal_after, now=None):
+    """Writes the hour files that are not sealed yet. Returns (written, sealed)."""
+    now = now or time.time()
+    days = {}
+    written = sealed = 0
+    for session_key, day_start, hour, start, series in store.hours():
+        tz = ZoneInfo(SESSIONS[session_key]["tz"]) if session_key in SESSIONS else timezone.utc
+        day_dir = os.path.join(
+            HOURS_DIR, session_key.replace("/", "-"),
+            datetime.fromtimestamp(day_start, tz).date().isoformat()
+        )
+        if day_dir not in days:
+            index = load_index(day_dir)
+            days[day_dir] = {"hours": set(index.get("hours", [])), "sealed": set(index.get("sealed", []))}
+        day = days[day_dir]
+        name = f"{hour:02d}"
+        path = os.path.join(day_dir, f"{name}.json")
+        day["hours"].add(name)
+
+        # Sealed hours are final: no rebuild, no rewrite
+        if name in day["sealed"] and os.path.exists(path):
+            sealed += 1
+            continue
+        data = {"s": start, "step": store.step, "d": series}
+        written += publisher.write_json(path, data, record=False, separators=(',', ':'))
+        # Written after the hour was over: this copy has every candle
+        if start + 3600 + seal_after <= now: day["sealed"].add(name)
+
+    for day_dir, day in days.items():
+        index = {
+            "hours": sorted(day["hours"]),
+            "open": sorted(day["hours"] - day["sealed"]),
+            "sealed": sorted(day["sealed"])
+        }
+        publisher.write_json(os.path.join(day_dir, "index.json"), index, record=False, separators=(',', ':'))
+    return written, sealed
@@ -0,0 +1,89 @@
+import json
+from datetime import datetime
+from typing import NamedTuple
+from markets import resolve_market
+
+# --- QUOTE RECORD ---
+# One compact tuple per quote, shared by the Supabase sink and the
+# latest_prices.json writer (no per-row dict for the payload, the JSON cache
+# and the DB copy).
+
+class Quote(NamedTuple):
+    """Latest price of one symbol. Field order = key order in latest_prices.json."""
+    symbol: str
+    company_name: str
+    market: str
+    price: float
+    change_percent: float
+    change_value: float
+    recorded_at: str
+    previous_close: float # Helpful for frontend
+
+    @classmethod
+    def from_dict(cls, row):
+        """Quote from a published latest_prices.json row (missing keys -> None)."""
+        return cls(*(row.get(field) for field in cls._fields))
+
+    def db_row(self):
+        """The stock_prices columns Supabase stores."""
+        return {
+            "symbol": self.symbol,
+            "price": self.price,
+            "change_percent": self.change_percent,
+            "change_value": self.change_value,
+            "recorded_at": self.recorded_at
+        }
+
+# --- JSON WRITER ---
+
+_encode_str = json.encoder.encode_basestring_ascii
+_ROW = "{" + ", ".join(f'"{field}": %s' for field in Quote._fields) + "}"
+
+def _encode(value):
+    """Same text json.dump would produce for a scalar."""
+    if type(value) is str: return _encode_str(value)
+    if type(value) is float:
+        if value != value: return "NaN"
+        if value in (float("inf"), float("-inf")): return "Infinity" if value > 0 else "-Infinity"
+        return float.__repr__(value)
+    return json.dumps(value)
+
+def quote_json(quote):
+    return _ROW % tuple(map(_encode, quote))
+
+def dump_quotes(quotes):
+    """Same text as json.dumps([...dicts...]), row by row."""
+    return "[" + ", ".join(map(quote_json, quotes)) + "]"
+
+def write_quotes(quotes, f):
+    f.write(dump_quotes(quotes))
+
+# --- COLUMNAR FORMAT ---
+# symbols.json holds what never changes between runs (symbol, company_name,
+# market) as parallel arrays in a fixed (sorted) symbol order.
+# latest_columns.json holds only the moving numbers, one array per field in
+# that same order (null = no quote yet), "t" as epoch seconds, and "v" = the
+# symbols.json version it lines up with.
+
+SYMBOLS_FILE = "symbols.json"
+COLUMNS_FILE = "latest_columns.json"
+NUMBER_COLUMNS = ("price", "change_percent", "change_value", "previous_close")
+
+def symbol_table(metadata_map):
+    """{symbol, company_name, market} arrays, sorted by symbol."""
+    symbols = sorted(metadata_map)
+    return {
+        "symbol": symbols,
+        "company_name": [metadata_map[s].get('company_name', s) for s in symbols],
+        "market": [resolve_market(s, metadata_map[s].get('market', 'US')) for s in symbols]
+    }
+
+def quote_columns(quotes, symbols, version):
+    """latest_columns.json content for `quotes` in `symbols` order."""
+    by_symbol = {q.symbol: q for q in quotes}
+    rows = [by_symbol.get(s) for s in symbols]
+    columns = {"v": version}
+    for field in NUMBER_COLUMNS:
+        columns[field] = [getattr(q, field) if q else None for q in rows]
+    columns["t"] = [int(datetime.fromisoformat(q.recorded_at).timestamp()) if q else None for q in rows]
+    return columns
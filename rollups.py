@@ -0,0 +1,87 @@
+import glob
+import json
+
+# --- MULTI-RESOLUTION ROLLUPS ---
+# Coarser rolling series folded in from the 5 minute store every run (never
+# refetched): the close of each 30 minute bar for the last week, of each
+# exchange-local day for the last months, etc. They survive the daily reset
+# of the history shards and are published as rollup_<name>_NN.json, sharded
+# like history_NN.json (same NN for a symbol, see shards.json).
+#
+# Per symbol: {"s": first bar, "i": [bar offsets from s], "p": [close]}.
+# Intraday rollups count "s"/"i" in epoch seconds / bar steps, daily ones in
+# days since 1970-01-01 (exchange-local date).
+
+DAY_SECONDS = 24 * 60 * 60
+
+def day_number(day_start):
+    """Local date of a local midnight epoch (all exchanges sit within 12h of UTC)."""
+    return (day_start + DAY_SECONDS // 2) // DAY_SECONDS
+
+class Rollup:
+    """One resolution: {symbol: {bar key: close}} trimmed to the last `keep_days`."""
+
+    def __init__(self, name, step, keep_days):
+        self.name = name
+        self.step = step  # Bar seconds, None = one bar per local day
+        self.keep_days = keep_days
+        self.series = {}
+
+    @property
+    def prefix(self):
+        return f"rollup_{self.name}"
+
+    @property
+    def unit(self):
+        return self.step or 1
+
+    def key(self, bar_start):
+        return bar_start if self.step else day_number(bar_start)
+
+    def load(self):
+        """Reads the series back from the published rollup files."""
+        for path in glob.glob(f"{self.prefix}_*.json"):
+            try:
+                with open(path) as f:
+                    shard = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for symbol, series in shard.items():
+                s, unit = series["s"], self.unit
+                self.series[symbol] = {s + i * unit: p for i, p in zip(series["i"], series["p"])}
+        return self
+
+    def update(self, store, now):
+        """Folds today's 5 minute store in, then drops bars past the window."""
+        for symbol, starts, closes in store.bars(self.step):
+            bars = self.series.setdefault(symbol, {})
+            for start, close in zip(starts.tolist(), closes.tolist()):
+                bars[self.key(start)] = close
+
+        cutoff = self.key(int(now) - self.keep_days * DAY_SECONDS)
+        for symbol in list(self.series):
+            bars = {k: c for k, c in self.series[symbol].items() if k >= cutoff}
+            if bars: self.series[symbol] = bars
+            else: del self.series[symbol]
+
+    def retain(self, symbols):
+        keep = set(symbols)
+        for symbol in [s for s in self.series if s not in keep]:
+            del self.series[symbol]
+
+    def encode(self, symbol):
+        keys = sorted(self.series[symbol])
+        s = keys[0]
+        return {
+            "s": s,
+            "i": [(k - s) // self.unit for k in keys],
+            "p": [self.series[symbol][k] for k in keys]
+        }
+
+    def items(self):
+        for symbol in sorted(self.series):
+            yield symbol, self.encode(symbol)
+
+def load_rollups(config):
+    """{name: Rollup} for a {name: (bar seconds | None, days kept)} config."""
+    return {name: Rollup(name, step, keep).load() for name, (step, keep) in config.items()}
@@ -1,11 +1,21 @@
 import os
+import glob
+import argparse
 import time
 import json
-import pandas as pd
-import yfinance as yf
-from datetime import datetime
-from supabase import create_client, Client
-import numpy as np
+import queue
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from startup import lazy_import, report_startup, report_imports
+from markets import resolve_market, should_fetch, exchange_tz, session_window
+from history_store import HistoryStore
+from rollups import load_rollups
+from sparklines import market_sparklines
+from providers import make_provider
+from quotes import Quote, dump_quotes, symbol_table, quote_columns, SYMBOLS_FILE, COLUMNS_FILE
+from publish import Publisher, ShardRing, digest, publish_delta, publish_shard_manifest, publish_hours, DELTA_FILE
+import history_codec
 
 # --- CONFIG ---
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
@@ -14,30 +24,902 @@ SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 # ⚡ INTERVAL SETTING ⚡
 # "5min" = 5 minute candles
 # This controls the resolution of your history files
-RESAMPLE_INTERVAL = "5min" 
+RESAMPLE_INTERVAL = "5min"
+RESAMPLE_SECONDS = 5 * 60
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("❌ CRITICAL ERROR: GitHub Secrets are missing.")
+# ⚡ DATA PROVIDER SETTING ⚡
+# "yahoo" = live, "record:<dir>" = live + save raw frames, "replay:<dir>" = offline
+PROVIDER = os.environ.get("SCRAPER_PROVIDER", "yahoo")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# ⚡ PIPELINE SETTING ⚡
+# How many batches may wait between two stages.
+# 2 = batch N+1 downloads while batch N is transformed and N-1 is upserted
+PIPELINE_QUEUE_SIZE = 2
 
-def chunks(lst, n):
-    """Helper to break list into smaller batches"""
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
+# ⚡ BATCH SIZE SETTING ⚡
+# Batch size adapts between MIN and MAX (AIMD): it grows by BATCH_SIZE_STEP
+# after every healthy batch and halves after a slow, failed or sparse one
+BATCH_SIZE_DEFAULT = 100
+BATCH_SIZE_MIN = 10
+BATCH_SIZE_MAX = 400
+BATCH_SIZE_STEP = 10
+BATCH_TARGET_LATENCY = 20.0 # Seconds a single yf.download may take
+BATCH_MAX_MISSING = 0.25    # Share of tickers without data before we back off
 
-def fetch_and_store():
-    print("--- 🚀 Starting Smart Scrape + Sharding + Crypto Support ---")
-    
-    # 1. Fetch Symbols & Metadata
-    all_stocks = [] 
+# ⚡ INCREMENTAL FETCH SETTING ⚡
+# Symbols with a recent watermark only download bars after their last stored
+# candle (minus a small overlap); new or stale ones get the FULL_PERIOD window
+FULL_PERIOD = "5d"
+WATERMARK_OVERLAP = 15 * 60          # Seconds re-fetched before the watermark
+WATERMARK_MAX_AGE = 4 * 24 * 60 * 60 # Older watermarks fall back to FULL_PERIOD
+
+# ⚡ RATE LIMIT SETTING ⚡
+# One token = one Yahoo request (yf.download makes one per ticker).
+# On 429s / empty answers the rate halves, then creeps back up per good batch
+YAHOO_RPS = float(os.environ.get("YAHOO_RPS", 20))
+YAHOO_BURST = 100
+YAHOO_MIN_RPS = 1.0
+YAHOO_RPS_RECOVERY = 1.0
+
+# ⚡ QUARANTINE SETTING ⚡
+# Failed batches are bisected until the tickers that throw are isolated.
+# Each isolation or full-window run without data is a strike; tickers with
+# QUARANTINE_STRIKES are skipped and only probed every QUARANTINE_PROBE_INTERVAL.
+# Network errors (timeouts, dropped connections) say nothing about the
+# tickers: the batch is retried TRANSIENT_RETRIES times, never bisected
+QUARANTINE_STRIKES = 3
+QUARANTINE_PROBE_INTERVAL = 24 * 60 * 60
+TRANSIENT_RETRIES = 1
+
+# ⚡ DAEMON SETTING ⚡
+# `python scraper.py --daemon` keeps state warm and ticks every interval
+DAEMON_INTERVAL = 5 * 60
+DAEMON_OFFSET = 30        # Seconds after the boundary, once the candle closed
+PROFILE_REFRESH_TICKS = 12 # Re-page stock_profiles about once an hour
+
+# ⚡ SHARD SETTING ⚡
+# Number of history_NN.json files (consistent hashing, see publish.py).
+# More shards = smaller downloads per symbol, more files per run
+HISTORY_SHARDS = int(os.environ.get("HISTORY_SHARDS", 16))
+
+# ⚡ ROLLUP SETTING ⚡
+# Coarser series kept rolling from the 5 minute data (rollup_<name>_NN.json):
+# name -> (bar seconds, days kept); None = one bar per exchange-local day
+ROLLUPS = {
+    "30m": (30 * 60, 7),
+    "1d": (None, 120),
+}
+
+# ⚡ SPARKLINE SETTING ⚡
+# Points per symbol in sparklines_<market>.json (LTTB downsample of today)
+SPARKLINE_POINTS = 30
+
+# ⚡ BINARY HISTORY SETTING ⚡
+# 1 = also publish history_X.bin next to every history_X.json shard
+# (delta + zig-zag varint ticks, see history_codec.py for the layout)
+PUBLISH_BINARY_HISTORY = os.environ.get("PUBLISH_BINARY_HISTORY", "0") == "1"
+
+# ⚡ HOURLY HISTORY SETTING ⚡
+# 1 = also publish hours/<market>/<date>/<HH>.json, one immutable file per
+# closed hour (only the open hour keeps changing -> long CDN caching)
+PUBLISH_HOURLY_HISTORY = os.environ.get("PUBLISH_HOURLY_HISTORY", "0") == "1"
+
+# Small JSON files that carry tuning state from one run to the next
+STATE_DIR = "state"
+
+_supabase = None
+
+def get_supabase():
+    """Supabase client, created on first use (importing the module stays cheap)."""
+    global _supabase
+    if _supabase is None:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError("❌ CRITICAL ERROR: GitHub Secrets are missing.")
+        _supabase = lazy_import("supabase").create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+def load_state(name, default):
+    """Reads state/<name>.json, falling back to `default`."""
+    try:
+        with open(os.path.join(STATE_DIR, f"{name}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_state(name, data):
+    """Writes state/<name>.json (committed with the data by the workflow).
+
+    Left untouched when the content is the same, so quiet runs commit nothing.
+    """
+    path = os.path.join(STATE_DIR, f"{name}.json")
+    text = json.dumps(data, indent=1, sort_keys=True)
+    try:
+        with open(path) as f:
+            if f.read() == text: return
+    except OSError:
+        pass
+    try:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+    except Exception as e:
+        print(f"❌ Error saving state {name}: {e}")
+
+# --- ADAPTIVE BATCH SIZE ---
+
+class BatchSizeController:
+    """AIMD controller for the number of tickers per yf.download call.
+
+    Healthy batches (fast, no exception, few missing tickers) add
+    BATCH_SIZE_STEP; anything else halves the size. The largest batch that
+    came back healthy since the last failure is persisted so the next run
+    starts there.
+    """
+
+    def __init__(self):
+        saved = load_state("batch_size", {})
+        size = int(saved.get("size", BATCH_SIZE_DEFAULT))
+        self.size = min(max(size, BATCH_SIZE_MIN), BATCH_SIZE_MAX)
+        self.last_good = self.size
+        self.grown = 0
+        self.shrunk = 0
+        self.lock = threading.Lock()
+
+    def observe(self, batch_len, latency, failed=False, missing_ratio=0.0):
+        with self.lock:
+            healthy = (
+                not failed
+                and latency <= BATCH_TARGET_LATENCY
+                and missing_ratio <= BATCH_MAX_MISSING
+            )
+            if healthy:
+                # The pipeline cut this batch a few steps ago, so its own length
+                # (not the current size) is what it proves
+                self.last_good = max(self.last_good, min(batch_len, BATCH_SIZE_MAX))
+                self.size = min(self.size + BATCH_SIZE_STEP, BATCH_SIZE_MAX)
+                self.grown += 1
+            else:
+                self.size = max(self.size // 2, BATCH_SIZE_MIN)
+                self.last_good = min(self.last_good, self.size)
+                self.shrunk += 1
+
+    def batches(self, symbols):
+        """Splits `symbols` into batches, each cut at the current size."""
+        i = 0
+        while i < len(symbols):
+            with self.lock:
+                n = self.size
+            yield symbols[i:i + n]
+            i += n
+
+    def save(self):
+        save_state("batch_size", {"size": self.last_good})
+        print(f"📏 Batch size: {self.last_good} saved (grew {self.grown}x, shrank {self.shrunk}x)")
+
+# --- QUARANTINE ---
+
+class Quarantine:
+    """Persisted list of tickers that keep failing (delisted, renamed...)."""
+
+    def __init__(self):
+        # {symbol: {"strikes": n, "reason": str, "since": epoch, "probe_at": epoch}}
+        self.entries = load_state("quarantine", {})
+        self.lock = threading.Lock()
+        self.added = 0
+        self.released = 0
+
+    def is_quarantined(self, symbol):
+        entry = self.entries.get(symbol)
+        return entry is not None and entry.get("since") is not None
+
+    def should_skip(self, symbol, now):
+        """Quarantined tickers are skipped until their next probe is due."""
+        with self.lock:
+            if not self.is_quarantined(symbol): return False
+            entry = self.entries[symbol]
+            if now < entry["probe_at"]: return True
+            # Probe now; if it fails quietly we simply wait for the next slot
+            entry["probe_at"] = now + QUARANTINE_PROBE_INTERVAL
+            return False
+
+    def strike(self, symbol, reason, strikes=1):
+        with self.lock:
+            entry = self.entries.setdefault(symbol, {"strikes": 0})
+            entry["strikes"] += strikes
+            entry["reason"] = reason
+            if entry["strikes"] >= QUARANTINE_STRIKES and not entry.get("since"):
+                now = time.time()
+                entry["since"] = now
+                entry["probe_at"] = now + QUARANTINE_PROBE_INTERVAL
+                self.added += 1
+                print(f"🚫 Quarantined {symbol}: {reason}")
+
+    def isolate(self, symbol, reason):
+        """A ticker that throws on its own: one strike, like a run without data."""
+        self.strike(symbol, reason)
+
+    def clear(self, symbol):
+        with self.lock:
+            entry = self.entries.pop(symbol, None)
+            if entry and entry.get("since"):
+                self.released += 1
+                print(f"✅ Released {symbol} from quarantine.")
+
+    def save(self, known):
+        save_state("quarantine", {s: e for s, e in self.entries.items() if s in known})
+        active = sum(1 for s in self.entries if s in known and self.is_quarantined(s))
+        print(f"🚫 Quarantine: {active} tickers (+{self.added} new, -{self.released} released)")
+
+# --- RATE LIMITER ---
+
+class TokenBucket:
+    """Requests-per-second budget shared by every thread that talks to Yahoo.
+
+    `acquire(n)` blocks until n tokens are available. Requests larger than
+    the bucket simply wait for the deficit, so big batches are still paced.
+    """
+
+    def __init__(self, rate=YAHOO_RPS, capacity=YAHOO_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+        self.acquired = 0
+        self.backoffs = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, n=1):
+        with self.lock:
+            self._refill()
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.acquired += n
+            self.waited += wait
+        # Sleep outside the lock; the debt is already booked, so others queue behind us
+        if wait > 0: time.sleep(wait)
+        return wait
+
+    def backoff(self):
+        """Upstream pushed back (429 / empty answer): halve the rate, drain the bucket."""
+        with self.lock:
+            self._refill()
+            self.rate = max(self.rate / 2, YAHOO_MIN_RPS)
+            self.tokens = min(self.tokens, 0.0)
+            self.backoffs += 1
+
+    def recover(self):
+        with self.lock:
+            self._refill()
+            self.rate = min(self.rate + YAHOO_RPS_RECOVERY, self.max_rate)
+
+    def report(self):
+        print(
+            f"⏳ Rate limiter: waited {self.waited:.1f}s for {self.acquired} requests | "
+            f"{self.backoffs} backoffs | rate {self.rate:.1f}/{self.max_rate:.1f} req/s"
+        )
+
+def is_rate_limited(error):
+    """Best-effort check whether a Yahoo error means we are being throttled."""
+    text = f"{type(error).__name__} {error}"
+    return any(k in text for k in ("429", "Too Many Requests", "RateLimit", "Rate limited"))
+
+def is_transient(error):
+    """Network / session trouble that would hit any ticker (retry, don't bisect)."""
+    if isinstance(error, (TimeoutError, ConnectionError)): return True
+    text = f"{type(error).__name__} {error}"
+    return any(k in text for k in (
+        "Timeout", "timed out", "ConnectionError", "Connection reset", "Connection refused",
+        "Could not resolve host", "Temporary failure in name resolution", "Invalid Crumb", "Unauthorized"
+    ))
+
+# --- PIPELINE ---
+
+_PIPELINE_DONE = object() # Sentinel that tells a stage its input is exhausted
+
+class PipelineStage(threading.Thread):
+    """One worker of the download -> transform -> upsert pipeline.
+
+    Pulls items from `inbox`, runs `func` on them and pushes the result to
+    `outbox` (if any). Busy and waiting time are tracked for the report.
+    """
+
+    def __init__(self, name, func, inbox, outbox, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.items = 0
+        self.busy_time = 0.0
+        self.wait_in = 0.0  # Starved: waiting for upstream
+        self.wait_out = 0.0 # Blocked: waiting for downstream
+
+    def _get(self):
+        t0 = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                item = self.inbox.get(timeout=0.2)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = _PIPELINE_DONE
+        self.wait_in += time.perf_counter() - t0
+        return item
+
+    def _put(self, item):
+        t0 = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                self.outbox.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        self.wait_out += time.perf_counter() - t0
+
+    def run(self):
+        while True:
+            item = self._get()
+            if item is _PIPELINE_DONE: break
+
+            t0 = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                print(f"⚠️ Batch failed ({self.name}): {e}")
+                result = None
+            self.busy_time += time.perf_counter() - t0
+            self.items += 1
+
+            if self.outbox is not None and result is not None:
+                self._put(result)
+
+        if self.outbox is not None:
+            self._put(_PIPELINE_DONE)
+
+def run_pipeline(batches, stages):
+    """Runs `batches` through `stages` ([(name, func), ...]) with bounded queues.
+
+    Each stage runs in its own thread, so the network and CPU phases of
+    neighbouring batches overlap. Returns the stage threads for reporting.
+    """
+    stop_event = threading.Event()
+    queues = [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in stages]
+    workers = []
+    for i, (name, func) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        workers.append(PipelineStage(name, func, queues[i], outbox, stop_event))
+
+    for w in workers: w.start()
+
+    try:
+        # The main thread feeds the first stage; the bounded queue gives backpressure
+        for batch in batches:
+            while True:
+                try:
+                    queues[0].put(batch, timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+        queues[0].put(_PIPELINE_DONE)
+
+        for w in workers:
+            while w.is_alive():
+                w.join(timeout=0.2)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for w in workers: w.join(timeout=5)
+        raise
+
+    return workers
+
+def report_pipeline(workers, wall_time):
+    """Prints how the wall-clock time was spent in every stage."""
+    print(f"📊 Pipeline wall time: {wall_time:.1f}s")
+    for w in workers:
+        util = (w.busy_time / wall_time * 100) if wall_time > 0 else 0.0
+        print(
+            f"   {w.name:<10} {util:5.1f}% busy | {w.items} batches | "
+            f"busy {w.busy_time:.1f}s, starved {w.wait_in:.1f}s, blocked {w.wait_out:.1f}s"
+        )
+
+
+# --- RUN CONTEXT ---
+
+def load_json(path, default):
+    """Reads a previously published JSON file, falling back to `default`."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def load_history_shards():
+    """Reads today's series back from the published history_X.json shards."""
+    history = {}
+    for filename in glob.glob("history_*.json"):
+        if filename == DELTA_FILE: continue
+        history.update(load_json(filename, {}))
+    return history
+
+class ScrapeContext:
+    """Everything a run shares between its pipeline stages.
+
+    In daemon mode the same context lives across ticks, so the symbol table,
+    watermarks, today's series and the HTTP session stay warm in memory.
+    """
+
+    def __init__(self, all_stocks, provider):
+        self.provider = provider
+        self.set_profiles(all_stocks)
+
+        self.latest_prices_cache = []
+        self.total_upserted = 0
+        self.ticks = 0
+
+        self.controller = BatchSizeController()
+        self.limiter = TokenBucket()
+        self.quarantine = Quarantine()
+
+        # Last stored candle per symbol: {"t": epoch, "d": day, "c": close, "pc": prev close}
+        self.watermarks = load_state("watermarks", {})
+        # What we published last run, so incremental fetches can extend it
+        self.published = load_history_shards()  # Series as clients last saw them
+        self.load_history(self.published)
+        self.rollups = load_rollups(ROLLUPS)
+        self.previous_prices = {p['symbol']: Quote.from_dict(p) for p in load_json('latest_prices.json', [])}
+
+    def set_profiles(self, all_stocks):
+        self.metadata_map = {s['symbol']: s for s in all_stocks}
+        self.symbol_list = [s['symbol'] for s in all_stocks]
+
+        # Today's series, kept in place across runs / ticks
+        if not hasattr(self, "history"): self.history = HistoryStore(RESAMPLE_SECONDS)
+        sizes = {}
+        for symbol in self.symbol_list:
+            key = self.session_of(symbol)[0]
+            sizes[key] = sizes.get(key, 0) + 1
+        for key, n in sizes.items(): self.history.reserve(key, n)
+        self.history.retain(self.symbol_list)
+
+    def session_of(self, symbol):
+        """(session key, (open, close)) the symbol's series are stored under."""
+        return session_window(symbol, self.metadata_map.get(symbol, {}).get('market', 'US'))
+
+    def load_history(self, published):
+        """Fills the history store from published {s, p} shards."""
+        for symbol, series in published.items():
+            if symbol not in self.metadata_map or not series.get("p"): continue
+            tz = ZoneInfo(self.timezone_group(symbol))
+            day = datetime.fromtimestamp(series["s"], tz).replace(hour=0, minute=0, second=0)
+            session_key, window = self.session_of(symbol)
+            self.history.put(symbol, session_key, int(day.timestamp()), window, series)
+
+    def start_tick(self):
+        """Rolls last tick's quotes over as the base the next tick extends."""
+        if self.ticks:
+            self.previous_prices = {q.symbol: q for q in self.latest_prices_cache}
+        self.latest_prices_cache = []
+        self.total_upserted = 0
+        self.frame_peak_bytes = self.frame_rows = self.frame_frames = 0
+        self.ticks += 1
+
+    def needs_full_fetch(self, symbol):
+        """New or stale symbols get the 5 day window, the rest only fresh bars."""
+        wm = self.watermarks.get(symbol)
+        if not wm or symbol not in self.history: return True
+        return wm["t"] < time.time() - WATERMARK_MAX_AGE
+
+    def scheduled_symbols(self):
+        """Drops quarantined symbols and ones whose exchange is closed with the final bar stored."""
+        now = datetime.now(timezone.utc)
+        active = [s for s in self.symbol_list if not self.quarantine.should_skip(s, now.timestamp())]
+        scheduled = [
+            s for s in active
+            if should_fetch(s, self.metadata_map[s].get('market', 'US'), self.watermarks.get(s), now)
+        ]
+        quarantined = len(self.symbol_list) - len(active)
+        if quarantined: print(f"🚫 Skipping {quarantined} quarantined symbols.")
+        skipped = len(active) - len(scheduled)
+        if skipped: print(f"💤 Skipping {skipped} symbols on closed exchanges.")
+        return scheduled
+
+    def timezone_group(self, symbol):
+        """Batches never mix exchanges, so yfinance frames stay dense (no union-index NaN rows)."""
+        return day_tz(symbol, self.metadata_map[symbol].get('market', 'US'))
+
+    def batches(self):
+        """Full-window symbols first, then incremental ones ordered by watermark.
+
+        Within each, symbols are grouped by exchange timezone.
+        """
+        full, incremental = {}, {}
+        for symbol in self.scheduled_symbols():
+            groups = full if self.needs_full_fetch(symbol) else incremental
+            groups.setdefault(self.timezone_group(symbol), []).append(symbol)
+
+        print(
+            f"🔁 Incremental fetch: {sum(map(len, incremental.values()))} symbols | "
+            f"Full {FULL_PERIOD} window: {sum(map(len, full.values()))} | "
+            f"{len(set(full) | set(incremental))} timezone groups"
+        )
+        for tz in sorted(full):
+            yield from self.controller.batches(full[tz])
+        for tz in sorted(incremental):
+            symbols = sorted(incremental[tz], key=lambda s: self.watermarks[s]["t"])
+            yield from self.controller.batches(symbols)
+
+    def note_frame(self, data):
+        """Tracks frame size + density for the run report."""
+        if data is None or data.empty: return
+        self.frame_peak_bytes = max(self.frame_peak_bytes, int(data.memory_usage(index=True).sum()))
+        self.frame_rows += len(data.index)
+        self.frame_frames += 1
+
+    def report_frames(self):
+        if not self.frame_frames: return
+        print(
+            f"🧮 Frames: {self.frame_frames} | peak {self.frame_peak_bytes / 1e6:.1f} MB | "
+            f"avg {self.frame_rows / self.frame_frames:.0f} rows"
+        )
+
+    def carry_forward(self):
+        """Keeps last run's quote for symbols without new bars (history stays in the store)."""
+        fresh = {q.symbol for q in self.latest_prices_cache}
+        carried = 0
+        for symbol in self.symbol_list:
+            # Don't keep republishing stale quotes of dead tickers
+            if self.quarantine.is_quarantined(symbol): continue
+            if symbol not in fresh and symbol in self.previous_prices:
+                self.latest_prices_cache.append(self.previous_prices[symbol])
+                carried += 1
+        if carried: print(f"↪️ Carried forward {carried} quotes without new bars.")
+
+    def save(self):
+        self.controller.save()
+        known = set(self.symbol_list)
+        self.quarantine.save(known)
+        save_state("watermarks", {s: wm for s, wm in self.watermarks.items() if s in known})
+
+# --- STAGES ---
+
+def missing_symbols(batch, data):
+    """Tickers of the batch that came back without any Close price."""
+    if data is None or data.empty: return list(batch)
+    # Flat columns: a lone ticker from yfinance < 1 or multi_level_index=False
+    if data.columns.nlevels == 1:
+        return [] if data['Close'].notna().any() else list(batch)
+
+    tickers = data.columns.levels[0]
+    return [
+        symbol for symbol in batch
+        if symbol not in tickers or not data[symbol]['Close'].notna().any()
+    ]
+
+def fetch_window(batch, ctx):
+    """yf.download window for a batch: bars after the oldest watermark, or FULL_PERIOD."""
+    if any(ctx.needs_full_fetch(s) for s in batch):
+        return {"period": FULL_PERIOD}
+
+    # Overlap re-fetches the last candle(s), which may still have been forming
+    oldest = min(ctx.watermarks[s]["t"] for s in batch)
+    return {"start": datetime.fromtimestamp(oldest - WATERMARK_OVERLAP, tz=timezone.utc)}
+
+def throttle(batch, ctx):
+    """Waits for the batch's request tokens (booked in the limiter report, not in batch latency)."""
+    if not ctx.provider.offline: ctx.limiter.acquire(len(batch))
+
+def yahoo_download(batch, window, ctx):
+    """One download through the configured provider (call throttle() first)."""
+    try:
+        # Full window: 5 days buffer to ensure we catch the current day
+        # (Crypto is 24/7, stocks are 9-4, this covers all cases)
+        return ctx.provider.download(batch, **window)
+    except Exception as e:
+        if is_rate_limited(e): ctx.limiter.backoff()
+        raise
+
+def bisect_download(batch, window, ctx):
+    """Retries a failed batch in halves until the tickers that throw are isolated."""
+    pieces = []
+    mid = len(batch) // 2
+    for half in (batch[:mid], batch[mid:]):
+        throttle(half, ctx)
+        try:
+            pieces.append((half, yahoo_download(half, window, ctx)))
+        except Exception as e:
+            # Splitting a throttled batch (or a dead connection) only makes it worse
+            if is_rate_limited(e) or is_transient(e): raise
+            if len(half) == 1: ctx.quarantine.isolate(half[0], f"{type(e).__name__}: {e}")
+            else: pieces.extend(bisect_download(half, window, ctx))
+    return pieces
+
+def download_batch(batch, ctx):
+    """Stage 1: Downloads one batch of candles from Yahoo.
+
+    Returns a list of (symbols, frame) pieces: one for a healthy batch,
+    several if the batch had to be bisected around failing tickers.
+    """
+    window = fetch_window(batch, ctx)
+
+    for attempt in range(TRANSIENT_RETRIES + 1):
+        # Waiting on our own token bucket is not Yahoo latency: keep it out of AIMD
+        throttle(batch, ctx)
+        t0 = time.perf_counter()
+        try:
+            data = yahoo_download(batch, window, ctx)
+            break
+        except Exception as e:
+            ctx.controller.observe(len(batch), time.perf_counter() - t0, failed=True)
+            if is_rate_limited(e): raise
+            if is_transient(e):
+                if attempt == TRANSIENT_RETRIES: raise
+                print(f"🔁 Batch of {len(batch)} hit {type(e).__name__}, retrying...")
+                continue
+            if len(batch) == 1:
+                ctx.quarantine.isolate(batch[0], f"{type(e).__name__}: {e}")
+                return []
+            print(f"✂️ Batch of {len(batch)} failed ({e}), bisecting...")
+            return bisect_download(batch, window, ctx)
+    latency = time.perf_counter() - t0
+
+    # Closed markets legitimately return nothing for an incremental window,
+    # but nothing at all over FULL_PERIOD smells like a dead ticker
+    missing = missing_symbols(batch, data) if "period" in window else []
+    missing_ratio = len(missing) / len(batch)
+
+    # yfinance swallows per-ticker errors; a throttled batch comes back empty,
+    # with 429s in its error log, or with many tickers all-NaN
+    errors = ctx.provider.last_errors()
+    throttled = (
+        data.empty
+        or any(is_rate_limited(e) for e in errors.values())
+        or (len(batch) > 1 and missing_ratio > BATCH_MAX_MISSING)
+    )
+    if throttled: ctx.limiter.backoff()
+    else: ctx.limiter.recover()
+
+    # A throttled frame says nothing about the tickers in it
+    if not throttled:
+        for symbol in missing:
+            ctx.quarantine.strike(symbol, f"no data in {FULL_PERIOD} window")
+    ctx.controller.observe(len(batch), latency, missing_ratio=missing_ratio)
+
+    return [(batch, data)]
+
+def batch_columns(batch, data):
+    """Close / Open as time x symbol frames, pulled out of the yfinance frame once."""
+    if data.columns.nlevels == 1:
+        return data[['Close']].set_axis(batch, axis=1), data[['Open']].set_axis(batch, axis=1)
+
+    # Handle Multi-Index columns from yfinance (ticker, field), one ticker included
+    tickers = data.columns.levels[0]
+    present = [s for s in batch if s in tickers]
+    closes = data.xs('Close', axis=1, level=1).reindex(columns=present)
+    opens = data.xs('Open', axis=1, level=1).reindex(columns=present)
+    return closes, opens
+
+def day_tz(symbol, market):
+    """Timezone whose midnight starts the symbol's day.
+
+    24/7, FX and indexes without a calendar use UTC, never the frame's own
+    timezone: that depends on what the symbol happened to be batched with.
+    """
+    return exchange_tz(symbol, market) or "UTC"
+
+def as_ns(index):
+    """Epoch nanoseconds of a DatetimeIndex, whatever its resolution (pandas 3 defaults to us)."""
+    return index.as_unit("ns").asi8 if hasattr(index, "as_unit") else index.asi8
+
+def session_index(index, tz):
+    """Row offsets where a new exchange-local day starts + each row's local midnight (ns).
+
+    Computed once per timezone per batch; lookups are then binary searches.
+    """
+    np = lazy_import("numpy")
+    local = index.tz_convert(tz) if index.tz is not None else index
+    midnights = as_ns(local.normalize())
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(midnights)) + 1))
+    return starts, midnights
+
+def batch_quotes(closes, opens, tzs):
+    """Last close, previous-day close and first open for every column in one pass.
+
+    Works on the raw (time x symbol) arrays: `last_valid[t, j]` is the last
+    row <= t where symbol j has a Close, so every lookup is an index, not a
+    per-symbol dropna / mask. `tzs[j]` is the timezone that decides where
+    symbol j's day starts (see day_tz).
+    """
+    np = lazy_import("numpy")
+    C = closes.to_numpy(dtype=float)
+    O = opens.to_numpy(dtype=float)
+    rows, cols = np.arange(C.shape[0]), np.arange(C.shape[1])
+
+    valid = ~np.isnan(C)
+    last_valid = np.maximum.accumulate(np.where(valid, rows[:, None], -1), axis=0)
+    last_idx = last_valid[-1] if len(rows) else np.full(len(cols), -1)
+    first_idx = np.argmax(valid, axis=0)
+    has_data = last_idx >= 0
+    safe_last = np.maximum(last_idx, 0)
+
+    # Day boundaries per exchange timezone, looked up by binary search
+    day_start = np.zeros(len(cols), dtype=np.int64)
+    midnight = np.zeros(len(cols), dtype=np.int64)
+    for tz in set(tzs):
+        group = np.array([j for j, t in enumerate(tzs) if t == tz], dtype=np.int64)
+        starts, midnights = session_index(closes.index, tz)
+        day_start[group] = starts[np.searchsorted(starts, safe_last[group], side='right') - 1]
+        midnight[group] = midnights[safe_last[group]]
+
+    # Previous close = last Close before the first row of the last candle's day
+    prev_idx = np.where(day_start > 0, last_valid[np.maximum(day_start - 1, 0), cols], -1)
+
+    return {
+        "C": C,
+        "has_data": has_data,
+        "last_idx": safe_last,
+        "last": C[safe_last, cols],
+        "prev_idx": prev_idx,
+        "prev": C[np.maximum(prev_idx, 0), cols],
+        "first_open": O[first_idx, cols],
+        "day_start": day_start,
+        "midnight": midnight,
+    }
+
+def today_slots(index_ns, values, start, stop):
+    """(start epoch, slot prices) on the RESAMPLE_INTERVAL grid for rows [start, stop].
+
+    Same slots as `.resample(RESAMPLE_INTERVAL).asfreq()` on today's rows
+    (NaN for gaps), but straight from array views: no whole-window mask, no copy.
+    """
+    np = lazy_import("numpy")
+    step = RESAMPLE_SECONDS * 10**9
+    t = index_ns[start:stop + 1]
+    v = values[start:stop + 1]
+    ok = ~np.isnan(v)
+    if not ok.any(): return None
+    t, v = t[ok], v[ok]
+
+    first = int(t[0] - t[0] % step)
+    last = int(t[-1] - t[-1] % step)
+    slots = np.full((last - first) // step + 1, np.nan)
+
+    # Candles off the 5 minute grid become gaps, exactly like asfreq()
+    aligned = (t - first) % step == 0
+    slots[(t[aligned] - first) // step] = [round(x, 2) for x in v[aligned].tolist()]
+
+    return first // 10**9, slots
+
+def process_batch(batch, data, ctx):
+    """Stage 2: Turns a downloaded frame into quotes + today's history."""
+    np = lazy_import("numpy")
+    payload = []
+
+    if data is None or data.empty: return payload
+    closes, opens = batch_columns(batch, data)
+    if not closes.index.is_monotonic_increasing:
+        closes, opens = closes.sort_index(), opens.sort_index()
+
+    symbols = list(closes.columns)
+    markets = [
+        resolve_market(s, ctx.metadata_map.get(s, {}).get('market', 'US')) for s in symbols
+    ]
+    tzs = [day_tz(s, m) for s, m in zip(symbols, markets)]
+    q = batch_quotes(closes, opens, tzs)
+    index = closes.index
+    index_ns = as_ns(index)
+
+    # --- 1. PREVIOUS CLOSE (needs the watermark fallbacks) ---
+    # Incremental windows may hold only today's bars, so the watermark
+    # remembers the previous close from the run that saw it
+    current_times = index[q["last_idx"]]
+    current_days = [
+        (t.tz_convert(tz) if t.tz is not None else t).date().isoformat()
+        for t, tz in zip(current_times, tzs)
+    ]
+    prev_close = q["prev"].copy()
+    same_session = [False] * len(symbols)
+
+    for j, symbol in enumerate(symbols):
+        if not q["has_data"][j]: continue
+        wm = ctx.watermarks.get(symbol)
+        same_session[j] = wm is not None and wm.get("d") == current_days[j]
+
+        # Calculate daily change
+        # For Crypto, "prev_close" is technically 00:00 UTC start price
+        if q["prev_idx"][j] >= 0: continue
+        elif same_session[j]: prev_close[j] = wm["pc"]
+        elif wm is not None: prev_close[j] = wm["c"]
+        else: prev_close[j] = q["first_open"][j]
+
+    # --- 2. LATEST PRICE LOGIC (whole batch at once) ---
+    current_price = q["last"]
+    change_value = current_price - prev_close
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = np.where(prev_close != 0, change_value / prev_close * 100, 0.0)
+
+    for j, symbol in enumerate(symbols):
+        if not q["has_data"][j]: continue
+        try:
+            # --- 3. METADATA & MARKET TYPE LOGIC ---
+            meta = ctx.metadata_map.get(symbol, {})
+            current_time = current_times[j]
+
+            # Data point for Supabase & latest_prices.json
+            data_point = Quote(
+                symbol,
+                meta.get('company_name', symbol),
+                markets[j],
+                round(float(current_price[j]), 2),
+                round(float(change_pct[j]), 2),
+                round(float(change_value[j]), 2),
+                current_time.to_pydatetime().isoformat(),
+                round(float(prev_close[j]), 2)
+            )
+
+            payload.append(data_point) # For Supabase
+            ctx.latest_prices_cache.append(data_point) # For JSON
+            ctx.quarantine.clear(symbol)
+
+            ctx.watermarks[symbol] = {
+                "t": int(current_time.timestamp()),
+                "d": current_days[j],
+                "c": round(float(current_price[j]), 4),
+                "pc": round(float(prev_close[j]), 4)
+            }
+
+            # --- 4. HISTORY CHART (OPTIMIZED + AUTO-RESET) ---
+            # STRICTLY TODAY ONLY: rows from the exchange-local day start to the
+            # last candle, gaps filled on the 5 minute grid so implicit indexing works
+            slots = today_slots(index_ns, q["C"][:, j], q["day_start"][j], q["last_idx"][j])
+            if slots is not None:
+                day_start = int(q["midnight"][j] // 10**9)
+                # Incremental: extend what we stored earlier this session,
+                # a new day starts the row from scratch
+                overlay = same_session[j] and ctx.history.day_of(symbol) == day_start
+                session_key, window = ctx.session_of(symbol)
+                ctx.history.write(symbol, session_key, day_start, window, *slots, overlay=overlay)
+
+        except Exception as inner_e:
+            continue
+
+    return payload
+
+def upsert_batch(payload):
+    """Stage 3: Writes the batch quotes to Supabase."""
+    if not payload: return 0
+
+    db_payload = [q.db_row() for q in payload]
+
+    get_supabase().table("stock_prices").upsert(
+        db_payload, on_conflict="symbol, recorded_at", ignore_duplicates=False
+    ).execute()
+    return len(payload)
+
+def load_profiles(provider):
+    """Symbols + metadata from Supabase (or from the recording when replaying).
+
+    None if a page failed or nothing came back: a partial symbol list would
+    prune watermarks, rollups and shards of every symbol it misses.
+    """
+    if provider.offline:
+        return provider.load_profiles() or None
+
+    all_stocks = []
     start = 0
     fetch_size = 1000
-    
+
     print("Fetching stock profiles from Supabase...")
     while True:
         try:
-            response = supabase.table("stock_profiles").select("symbol, company_name, market").range(start, start + fetch_size - 1).execute()
+            response = get_supabase().table("stock_profiles").select("symbol, company_name, market").range(start, start + fetch_size - 1).execute()
             rows = response.data
             if not rows: break
             for r in rows:
@@ -49,190 +931,266 @@ def fetch_and_store():
             start += fetch_size
         except Exception as e:
             print(f"⚠️ Error fetching profiles: {e}")
-            break
-    
-    print(f"✅ Found {len(all_stocks)} stocks/cryptos.")
-    
-    # 2. Process Batch
-    BATCH_SIZE = 100 
-    total_upserted = 0
-    
-    latest_prices_cache = [] 
-    history_cache = {} 
-    metadata_map = {s['symbol']: s for s in all_stocks}
-    symbol_list = [s['symbol'] for s in all_stocks]
-
-    try: 
-        for batch in chunks(symbol_list, BATCH_SIZE):
-            try:
-                tickers_for_yahoo = " ".join(batch)
-                
-                # Download 5 days buffer to ensure we catch the current day
-                # (Crypto is 24/7, stocks are 9-4, this covers all cases)
-                data = yf.download(
-                    tickers_for_yahoo, 
-                    period="5d",
-                    interval="5m", 
-                    progress=False, 
-                    group_by='ticker',
-                    threads=True,
-                    auto_adjust=False 
-                )
-                
-                payload = []
-                
-                for symbol in batch:
-                    try:
-                        yahoo_symbol = symbol 
-                        # Handle Multi-Index columns from yfinance
-                        if len(batch) == 1: stock_df = data
-                        else:
-                            if yahoo_symbol not in data.columns.levels[0]: continue
-                            stock_df = data[yahoo_symbol]
-                        
-                        if stock_df.empty: continue
-                        stock_df = stock_df.dropna(subset=['Close'])
-                        if stock_df.empty: continue
-
-                        # --- 1. METADATA & MARKET TYPE LOGIC ---
-                        meta = metadata_map.get(symbol, {})
-                        market_type = meta.get('market', 'US')
-                        
-                        # Auto-detect Crypto if not explicitly set in DB
-                        if (market_type == 'US') and ('-USD' in symbol or 'BTC' in symbol or 'ETH' in symbol):
-                            market_type = 'CRYPTO'
-
-                        # --- 2. LATEST PRICE LOGIC ---
-                        last_candle = stock_df.iloc[-1]
-                        current_price = float(last_candle['Close'])
-                        current_time = last_candle.name 
-                        
-                        # Calculate daily change
-                        # For Crypto, "prev_close" is technically 00:00 UTC start price
-                        prev_data = stock_df[stock_df.index.normalize() < current_time.normalize()]
-                        prev_close = float(prev_data.iloc[-1]['Close']) if not prev_data.empty else float(stock_df.iloc[0]['Open'])
-                        
-                        change_value = current_price - prev_close
-                        change_pct = ((change_value) / prev_close * 100) if prev_close != 0 else 0.0
-
-                        # Data point for Supabase & latest_prices.json
-                        data_point = {
-                            "symbol": symbol,
-                            "company_name": meta.get('company_name', symbol),
-                            "market": market_type,
-                            "price": round(current_price, 2),
-                            "change_percent": round(change_pct, 2),
-                            "change_value": round(change_value, 2),
-                            "recorded_at": current_time.to_pydatetime().isoformat(),
-                            "previous_close": round(prev_close, 2) # Helpful for frontend
-                        }
-
-                        payload.append(data_point) # For Supabase
-                        latest_prices_cache.append(data_point) # For JSON
-
-                        # --- 3. HISTORY CHART (OPTIMIZED + AUTO-RESET) ---
-                        
-                        # A. Filter: STRICTLY TODAY ONLY
-                        # This drops yesterday's data instantly when a new day starts
-                        last_ts = stock_df.index[-1]
-                        todays_data = stock_df[stock_df.index.normalize() == last_ts.normalize()].copy()
-                        
-                        # B. Resample: Fix gaps (e.g. missing 5 mins) so implicit indexing works
-                        # This ensures chart width is correct even if volume is low
-                        todays_data = todays_data.resample(RESAMPLE_INTERVAL).asfreq()
-                        
-                        # C. Format: { s: timestamp, p: [price, price...] }
-                        if not todays_data.empty:
-                            start_timestamp = int(todays_data.index[0].timestamp())
-                            
-                            # Create list of prices (None for gaps)
-                            prices_list = [
-                                round(x, 2) if pd.notna(x) else None 
-                                for x in todays_data['Close'].tolist()
-                            ]
-
-                            history_cache[symbol] = {
-                                "s": start_timestamp,     
-                                "p": prices_list          
-                            }
-
-                    except Exception as inner_e:
-                        continue
-
-                # --- UPSERT TO SUPABASE ---
-                if payload:
-                    db_payload = [{
-                        "symbol": p["symbol"],
-                        "price": p["price"],
-                        "change_percent": p["change_percent"],
-                        "change_value": p["change_value"],
-                        "recorded_at": p["recorded_at"]
-                    } for p in payload]
-
-                    supabase.table("stock_prices").upsert(
-                        db_payload, on_conflict="symbol, recorded_at", ignore_duplicates=False
-                    ).execute()
-                    total_upserted += len(payload)
-                
-                time.sleep(0.5)
+            return None
 
-            except Exception as e:
-                print(f"⚠️ Batch failed: {e}")
+    if not all_stocks:
+        print("⚠️ stock_profiles came back empty.")
+        return None
+    if hasattr(provider, "save_profiles"): provider.save_profiles(all_stocks)
+    return all_stocks
+
+def save_outputs(ctx):
+    """Writes latest_prices.json + the history shards that changed since the last run."""
+    publisher = Publisher()
+
+    print("\n💾 Saving JSON Files...")
+
+    # 1. Save Latest Prices (One big file is fine for lists/search)
+    # Sorted by symbol so batch order doesn't change the bytes
+    latest = sorted(ctx.latest_prices_cache)
+    try:
+        if publisher.write('latest_prices.json', dump_quotes(latest).encode()):
+            print("✅ latest_prices.json saved.")
+        else:
+            print("⏭️ latest_prices.json unchanged.")
+    except Exception as e:
+        print(f"❌ Error saving latest_prices: {e}")
+
+    # 1b. Columnar quotes + the static symbol table they index into
+    try:
+        table = symbol_table(ctx.metadata_map)
+        table_bytes = json.dumps(table, separators=(',', ':')).encode()
+        publisher.write(SYMBOLS_FILE, table_bytes)
+        columns = quote_columns(latest, table["symbol"], digest(table_bytes)[:12])
+        publisher.write_json(COLUMNS_FILE, columns, separators=(',', ':'))
+    except Exception as e:
+        print(f"❌ Error saving columnar quotes: {e}")
+
+    # 2. SHARDING HISTORY LOGIC
+    print("⚡ Sharding history files...")
+    # Hash ring instead of first letters: 'S' and '.NS' heavy alphabets
+    # no longer make one shard 50x the size of another
+    ring = ShardRing(HISTORY_SHARDS)
+    shards = ring.split(sorted(ctx.history.items()))
+
+    # 3. Save Shards (only the ones whose bytes changed)
+    saved = 0
+    for shard_name, shard_data in shards.items():
+        filename = f"{shard_name}.json"
+        try:
+            # separators removes whitespace to save bytes
+            saved += publisher.write_json(filename, shard_data, separators=(',', ':'))
+            if PUBLISH_BINARY_HISTORY:
+                publisher.write(f"{shard_name}.bin", history_codec.encode(shard_data))
+        except Exception as e:
+            print(f"❌ Error saving {filename}: {e}")
+
+    print(f"✅ Saved {saved} of {len(shards)} history shards.")
+
+    # 3b. Rollups: fold today's 5 minute bars in, publish sharded like history
+    # Names are claimed before the write, so a failed update can't get the
+    # (only) copy of the rollup swept away below
+    names = set(shards)
+    for rollup in ctx.rollups.values():
+        names.update(ring.names(rollup.prefix))
+        try:
+            rollup.update(ctx.history, time.time())
+            rollup.retain(ctx.metadata_map)
+            rollup_shards = ring.split(rollup.items(), prefix=rollup.prefix)
+            written = sum(
+                publisher.write_json(f"{name}.json", data, separators=(',', ':'))
+                for name, data in rollup_shards.items()
+            )
+            bars = sum(len(b) for b in rollup.series.values())
+            print(f"✅ Rollup {rollup.name}: {len(rollup.series)} symbols, {bars} bars, {written} shards saved.")
+        except Exception as e:
+            print(f"❌ Error saving rollup {rollup.name}: {e}")
+
+    # 3c. Sparklines: one small file per market for list views
+    try:
+        lines = market_sparklines(ctx.history, SPARKLINE_POINTS)
+        for session_key, market_lines in lines.items():
+            name = f"sparklines_{session_key.replace('/', '-')}"
+            names.add(name)
+            publisher.write_json(f"{name}.json", dict(sorted(market_lines.items())), separators=(',', ':'))
+        print(f"✅ Sparklines: {sum(map(len, lines.values()))} symbols in {len(lines)} market files.")
+    except Exception as e:
+        print(f"❌ Error saving sparklines: {e}")
+        # Keep last run's files rather than sweeping them
+        names.update(path.rsplit(".", 1)[0] for path in glob.glob("sparklines_*.json"))
+
+    # Shards of an older layout (first letters, another shard count) are retired
+    stale = ["history_*.json", "history_*.bin", "rollup_*.json", "sparklines_*.json"]
+    for path in [p for pattern in stale for p in glob.glob(pattern)]:
+        if path != DELTA_FILE and path.rsplit(".", 1)[0] not in names: publisher.remove(path)
+
+    try:
+        sizes = publish_shard_manifest(publisher, ring, shards)
+        print(
+            f"📦 {len(sizes)} shards: min {min(sizes) / 1024:.1f} KB | "
+            f"avg {sum(sizes) / len(sizes) / 1024:.1f} KB | max {max(sizes) / 1024:.1f} KB"
+        )
+    except Exception as e:
+        print(f"❌ Error saving shard manifest: {e}")
+
+    # 4. Delta against what the previous run published (cheap polling)
+    current = {symbol: data for shard_data in shards.values() for symbol, data in shard_data.items()}
+    try:
+        points = publish_delta(publisher, ctx.published, current)
+        ctx.published = current
+        if points: print(f"✅ history_delta.json: {points} points, seq {publisher.meta['delta_seq']}")
+    except Exception as e:
+        print(f"❌ Error saving history delta: {e}")
+
+    # 5. Hour buckets (sealed hours are left alone)
+    if PUBLISH_HOURLY_HISTORY:
+        try:
+            written, sealed = publish_hours(publisher, ctx.history, seal_after=WATERMARK_OVERLAP)
+            print(f"✅ Hourly history: {written} hour files written, {sealed} sealed.")
+        except Exception as e:
+            print(f"❌ Error saving hourly history: {e}")
+
+    try:
+        publisher.save()
+    except Exception as e:
+        print(f"❌ Error saving manifest: {e}")
+    publisher.report()
+
+def run_tick(ctx):
+    """One scrape over the warm context. Returns False if it was interrupted."""
+    ctx.start_tick()
+    print(f"📏 Starting with batch size {ctx.controller.size}")
+    interrupted = False
+
+    def transform_stage(pieces):
+        payload = []
+        for batch, data in pieces:
+            ctx.note_frame(data)
+            payload.extend(process_batch(batch, data, ctx))
+        return payload
+
+    def upsert_stage(payload):
+        # Replays never write to the live database
+        if ctx.provider.offline: ctx.total_upserted += len(payload)
+        else: ctx.total_upserted += upsert_batch(payload)
+
+    try:
+        t0 = time.perf_counter()
+        workers = run_pipeline(ctx.batches(), [
+            ("download", lambda batch: download_batch(batch, ctx)),
+            ("transform", transform_stage),
+            ("upsert", upsert_stage),
+        ])
+        report_pipeline(workers, time.perf_counter() - t0)
+        ctx.report_frames()
+        ctx.history.report()
 
     except KeyboardInterrupt:
         print("\n🛑 Interrupted.")
+        interrupted = True
     except Exception as e:
         print(f"\n❌ Script crashed: {e}")
     finally:
+        ctx.limiter.report()
+        ctx.provider.report()
+        ctx.carry_forward()
+        ctx.save()
+
         # --- SAVE JSON FILES (ALWAYS RUNS) ---
-        print("\n💾 Saving JSON Files...")
-        
-        # 1. Save Latest Prices (One big file is fine for lists/search)
-        try:
-            with open('latest_prices.json', 'w') as f:
-                json.dump(latest_prices_cache, f)
-            print("✅ latest_prices.json saved.")
-        except Exception as e:
-            print(f"❌ Error saving latest_prices: {e}")
-
-        # 2. SHARDING HISTORY LOGIC
-        print("⚡ Sharding history files...")
-        shards = {}
-        
-        for symbol, data in history_cache.items():
-            # Get first character (e.g., 'A' from 'AAPL', 'B' from 'BTC-USD')
-            first_char = symbol[0].upper()
-            
-            # Determine bucket name
-            if first_char.isalpha():
-                shard_name = f"history_{first_char}" # history_A.json
-            else:
-                shard_name = "history_0-9" # history_0-9.json
-            
-            if shard_name not in shards:
-                shards[shard_name] = {}
-            
-            shards[shard_name][symbol] = data
-
-        # 3. Save Shards
-        for shard_name, shard_data in shards.items():
-            filename = f"{shard_name}.json"
-            try:
-                with open(filename, 'w') as f:
-                    # separators removes whitespace to save bytes
-                    json.dump(shard_data, f, separators=(',', ':'))
-            except Exception as e:
-                print(f"❌ Error saving {filename}: {e}")
-        
-        print(f"✅ Saved {len(shards)} history shards.")
+        save_outputs(ctx)
 
         # --- CLEANUP ---
-        print("🧹 Cleaning up old database entries...")
-        try: 
-            supabase.rpc("delete_old_prices").execute()
-        except: pass
-        
-        print(f"--- 🏁 Done. Upserted {total_upserted} candles. ---")
+        if not ctx.provider.offline:
+            print("🧹 Cleaning up old database entries...")
+            try:
+                get_supabase().rpc("delete_old_prices").execute()
+            except: pass
+
+        print(f"--- 🏁 Done. Upserted {ctx.total_upserted} candles. ---")
+
+    return not interrupted
+
+def nothing_to_do():
+    """Cheap pre-check from last run's files: is every known symbol closed and final?
+
+    Runs before any heavy import or network call, so closed-market runs exit
+    within the startup budget.
+    """
+    known = load_json('latest_prices.json', [])
+    if not known: return False
+
+    watermarks = load_state("watermarks", {})
+    now = datetime.now(timezone.utc)
+    return not any(
+        should_fetch(p['symbol'], p.get('market', 'US'), watermarks.get(p['symbol']), now)
+        for p in known
+    )
+
+def fetch_and_store():
+    """One-shot run (what the GitHub workflow calls every 5 minutes)."""
+    print("--- 🚀 Starting Smart Scrape + Sharding + Crypto Support ---")
+    if PROVIDER == "yahoo" and nothing_to_do():
+        print("💤 All markets closed and up to date. Nothing to do.")
+        report_startup("Nothing to do")
+        return
+
+    report_startup()
+    provider = make_provider(PROVIDER)
+
+    # 1. Fetch Symbols & Metadata
+    all_stocks = load_profiles(provider)
+    if not all_stocks:
+        # Saving now would wipe rollups, shards and state of every symbol
+        print("❌ No stock profiles, skipping this run (published files and state kept).")
+        return
+    print(f"✅ Found {len(all_stocks)} stocks/cryptos.")
+
+    # 2. Process Batch
+    run_tick(ScrapeContext(all_stocks, provider))
+    report_imports()
+
+def run_daemon(interval=DAEMON_INTERVAL):
+    """Resident mode: one tick per `interval`, aligned to the wall clock.
+
+    Imports, the HTTP session, the symbol table and today's series are set
+    up once; stock_profiles is only re-paged every PROFILE_REFRESH_TICKS.
+    """
+    print(f"--- 🚀 Starting scraper daemon (every {interval}s) ---")
+    provider = make_provider(PROVIDER)
+    all_stocks = load_profiles(provider)
+    if not all_stocks:
+        print("❌ No stock profiles, daemon not started.")
+        return
+    print(f"✅ Found {len(all_stocks)} stocks/cryptos.")
+    ctx = ScrapeContext(all_stocks, provider)
+
+    while True:
+        if ctx.ticks and ctx.ticks % PROFILE_REFRESH_TICKS == 0:
+            # A failed refresh keeps the last good symbol list (nothing gets pruned)
+            all_stocks = load_profiles(provider)
+            if all_stocks:
+                ctx.set_profiles(all_stocks)
+                print(f"✅ Refreshed {len(ctx.symbol_list)} stocks/cryptos.")
+            else:
+                print(f"⚠️ Profile refresh failed, keeping {len(ctx.symbol_list)} stocks/cryptos.")
+
+        if not run_tick(ctx): break
+
+        # Sleep to the next boundary (+ offset, so the last candle has closed)
+        now = time.time()
+        wake = now - now % interval + interval + DAEMON_OFFSET
+        print(f"💤 Next tick at {datetime.fromtimestamp(wake, tz=timezone.utc).strftime('%H:%M:%S')} UTC")
+        try:
+            time.sleep(max(wake - time.time(), 0))
+        except KeyboardInterrupt:
+            print("\n🛑 Daemon stopped.")
+            break
 
 if __name__ == "__main__":
-    fetch_and_store()
+    parser = argparse.ArgumentParser(description="Stock price scraper")
+    parser.add_argument("--daemon", action="store_true", help="keep running and scrape every --interval seconds")
+    parser.add_argument("--interval", type=int, default=DAEMON_INTERVAL, help="seconds between daemon ticks")
+    args = parser.parse_args()
+
+    if args.daemon: run_daemon(args.interval)
+    else: fetch_and_store()
@@ -1,17 +1,21 @@
 import os
-import requests
-import pandas as pd
 from io import StringIO
-from supabase import create_client, Client
+from startup import lazy_import, report_imports
 
 # --- CONFIG ---
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("❌ CRITICAL ERROR: GitHub Secrets are missing.")
+_supabase = None
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+def get_supabase():
+    """Supabase client, created on first use (importing the module stays cheap)."""
+    global _supabase
+    if _supabase is None:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError("❌ CRITICAL ERROR: GitHub Secrets are missing.")
+        _supabase = lazy_import("supabase").create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
 
 # Browser Headers to prevent blocking
 HEADERS = {
@@ -20,6 +24,8 @@ HEADERS = {
 
 def fetch_wiki_table(url, match_text):
     """Helper to fetch and parse a Wiki table safely."""
+    requests = lazy_import("requests")
+    pd = lazy_import("pandas")
     try:
         response = requests.get(url, headers=HEADERS)
         response.raise_for_status()
@@ -69,6 +75,8 @@ def get_nifty50():
 def get_nifty500():
     print("🇮🇳 Fetching Nifty 500 (Official CSV)...")
     url = "https://www.niftyindices.com/IndexConstituent/ind_nifty500list.csv"
+    requests = lazy_import("requests")
+    pd = lazy_import("pandas")
     
     try:
         response = requests.get(url, headers=HEADERS)
@@ -159,6 +167,7 @@ def get_global_indexes():
 # --- MAIN EXECUTION ---
 
 def seed_database():
+    supabase = get_supabase() # Fail fast if the secrets are missing
     master_list = []
 
     # 1. Aggregate Regional Stocks
@@ -185,6 +194,7 @@ def seed_database():
             print(f"❌ Error on batch {i}: {e}")
 
     print("✅ Database seeding complete!")
+    report_imports()
 
 if __name__ == "__main__":
     seed_database()
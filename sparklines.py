@@ -0,0 +1,115 @@
+from startup import lazy_import
+
+# --- SPARKLINES ---
+# List views only need a tiny chart per symbol. Every session grid of the
+# history store is downsampled with Largest-Triangle-Three-Buckets to a fixed
+# number of points (all symbols of a grid at once, one numpy step per bucket)
+# and published as sparklines_<market>.json:
+# {symbol: {"s": first point, "d": [5 minute slots to the next point],
+#           "lo": low, "hi": high, "q": [level 0..LEVELS-1]}}
+# price = lo + q * (hi - lo) / (LEVELS - 1): a sparkline is a few dozen pixels
+# tall, so LEVELS steps are below what can be seen and cost 1-2 digits a point.
+
+LEVELS = 100
+
+def lttb(x, y, counts, n_out):
+    """Indices (into each row) of the LTTB points, [rows x n_out], -1 = unused.
+
+    x / y are [rows x width] with every row's `counts[r]` points packed to the
+    left. Rows with no more than n_out points keep all of them.
+    """
+    np = lazy_import("numpy")
+    rows, width = y.shape
+    picked = np.full((rows, n_out), -1)
+
+    small = counts <= n_out
+    keep = np.arange(n_out)[None, :] < counts[small][:, None]
+    picked[small] = np.where(keep, np.arange(n_out), -1)
+    if small.all(): return picked
+
+    big = np.flatnonzero(~small)
+    xs, ys, n = x[big], y[big], counts[big]
+    R = np.arange(len(big))
+
+    # Bucket k spans [edges[k], edges[k + 1]) (first and last point are fixed)
+    every = (n - 2) / (n_out - 2)
+    edges = np.floor(np.arange(n_out)[None, :] * every[:, None]).astype(int) + 1
+    edges = np.minimum(edges, n[:, None])
+    widest = int((edges[:, 1:] - edges[:, :-1]).max())
+
+    zero = np.zeros((len(big), 1))
+    cum_x = np.hstack([zero, np.cumsum(xs, axis=1)])
+    cum_y = np.hstack([zero, np.cumsum(ys, axis=1)])
+
+    out = np.zeros((len(big), n_out), dtype=int)
+    out[:, -1] = n - 1
+    a = np.zeros(len(big), dtype=int)
+    for i in range(n_out - 2):
+        # Average of the next bucket = the third triangle corner
+        lo, hi = edges[:, i + 1], edges[:, i + 2]
+        size = hi - lo
+        avg_x = (cum_x[R, hi] - cum_x[R, lo]) / size
+        avg_y = (cum_y[R, hi] - cum_y[R, lo]) / size
+
+        candidates = edges[:, i][:, None] + np.arange(widest)[None, :]
+        inside = candidates < edges[:, i + 1][:, None]
+        candidates = np.minimum(candidates, width - 1)
+        px, py = xs[R[:, None], candidates], ys[R[:, None], candidates]
+        ax, ay = xs[R, a][:, None], ys[R, a][:, None]
+
+        area = np.abs((ax - avg_x[:, None]) * (py - ay) - (ax - px) * (avg_y[:, None] - ay))
+        # Exact ties (common with cent prices) go to the earliest point, not to float noise
+        area = np.round(area, 9)
+        a = candidates[R, np.argmax(np.where(inside, area, -1.0), axis=1)]
+        out[:, i + 1] = a
+
+    picked[big] = out
+    return picked
+
+def market_sparklines(store, n_out):
+    """{session key: {symbol: {s, d, lo, hi, q}}} from every session grid of the store."""
+    np = lazy_import("numpy")
+    markets = {}
+    for (session_key, _), grid in store.grids.items():
+        if not grid.rows: continue
+        symbols = list(grid.rows)
+        rows = np.array([grid.rows[s] for s in symbols])
+        valid = grid.valid[rows]
+
+        # Pack each row's filled slots to the left (slot index = x)
+        order = np.argsort(~valid, axis=1, kind="stable")
+        counts = valid.sum(axis=1)
+        x = order.astype(float)
+        y = np.take_along_axis(grid.values[rows], order, axis=1)
+        y = np.where(np.arange(grid.slots)[None, :] < counts[:, None], y, 0.0)
+
+        picked = lttb(x, y, counts, n_out)
+        used = picked >= 0
+        slots = np.take_along_axis(order, np.maximum(picked, 0), axis=1)
+        prices = np.take_along_axis(y, np.maximum(picked, 0), axis=1)
+        lo = np.where(used, prices, np.inf).min(axis=1)
+        hi = np.where(used, prices, -np.inf).max(axis=1)
+        scale = np.where(hi > lo, (LEVELS - 1) / np.where(hi > lo, hi - lo, 1), 0)
+        levels = np.rint((prices - lo[:, None]) * scale[:, None]).astype(int)
+
+        lines = markets.setdefault(session_key, {})
+        for r, symbol in enumerate(symbols):
+            k = int(used[r].sum())
+            if not k: continue
+            lines[symbol] = {
+                "s": int(grid.origin + slots[r, 0] * store.step),
+                "d": np.diff(slots[r, :k]).tolist(),
+                "lo": float(lo[r]),
+                "hi": float(hi[r]),
+                "q": levels[r, :k].tolist()
+            }
+    return markets
+
+def decode(line, step):
+    """[(epoch, price)] of one published sparkline; `step` = slot seconds."""
+    t, points = line["s"], []
+    level = (line["hi"] - line["lo"]) / (LEVELS - 1)
+    for i, q in enumerate(line["q"]):
+        if i: t += line["d"][i - 1] * step
+        points.append((t, line["lo"] + q * level))
+    return points
@@ -0,0 +1,36 @@
+import sys
+import time
+import importlib
+
+# --- STARTUP BUDGET ---
+# Heavy libraries (pandas, yfinance, supabase...) are imported on first use
+# through lazy_import(), which also times them for the startup report.
+
+STARTED_AT = time.perf_counter()
+
+# Seconds a run may spend before it starts real work (or decides there is none)
+STARTUP_BUDGET = 1.0
+
+IMPORT_TIMES = {}
+
+def lazy_import(name):
+    """Imports `name` on first use and records how long that took."""
+    module = sys.modules.get(name)
+    if module is not None: return module
+
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - t0
+    return module
+
+def report_startup(label="Startup"):
+    """Prints time since process start against STARTUP_BUDGET."""
+    elapsed = time.perf_counter() - STARTED_AT
+    flag = "✅" if elapsed <= STARTUP_BUDGET else "⚠️ over budget"
+    print(f"⏱️ {label}: {elapsed:.2f}s (budget {STARTUP_BUDGET:.1f}s) {flag}")
+    report_imports()
+
+def report_imports():
+    """Prints what each lazily imported library cost, slowest first."""
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda kv: -kv[1]):
+        print(f"   import {name:<12} {seconds:.2f}s")